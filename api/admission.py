@@ -0,0 +1,115 @@
+import threading
+from collections import deque
+from flask import current_app, request, g
+from .errors import service_unavailable
+from .helpers import count
+
+HIGH, LOW = 0, 1
+
+
+class Waiter(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.admitted = False
+
+
+class AdmissionController(object):
+    """Limit the number of requests that a process handles at once.
+
+    Up to `max_in_flight` requests run concurrently. Requests that arrive
+    when all the slots are taken wait in a queue for up to `queue_timeout`
+    seconds, and requests that cannot get a slot in that time, or that find
+    the queue full, are rejected. A slot that is released goes to the
+    oldest high priority request in the queue, or to the oldest low
+    priority one if there are no high priority requests waiting. A high
+    priority request that finds the queue full takes the place of the
+    newest low priority request, which is rejected.
+    """
+    def __init__(self, max_in_flight, queue_size, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.queues = (deque(), deque())
+
+    def waiting(self):
+        return len(self.queues[HIGH]) + len(self.queues[LOW])
+
+    def acquire(self, priority):
+        """Wait for a slot. Returns `True` if the request can run, or `False`
+        if it has to be rejected."""
+        with self.lock:
+            if self.in_flight < self.max_in_flight and not self.waiting():
+                self.in_flight += 1
+                return True
+            if self.waiting() >= self.queue_size:
+                if priority == LOW or not self.queues[LOW]:
+                    return False
+                # wake up the evicted request, which is not admitted
+                self.queues[LOW].pop().event.set()
+            waiter = Waiter()
+            self.queues[priority].append(waiter)
+        waiter.event.wait(self.queue_timeout)
+        with self.lock:
+            if not waiter.admitted and waiter in self.queues[priority]:
+                self.queues[priority].remove(waiter)
+            return waiter.admitted
+
+    def release(self):
+        with self.lock:
+            for queue in self.queues:
+                if queue:
+                    # the slot is handed over without decrementing the count
+                    waiter = queue.popleft()
+                    waiter.admitted = True
+                    waiter.event.set()
+                    return
+            self.in_flight -= 1
+
+
+def init_app(app):
+    app.config.setdefault('ADMISSION_MAX_IN_FLIGHT', 4)
+    app.config.setdefault('ADMISSION_QUEUE_SIZE', 16)
+    app.config.setdefault('ADMISSION_QUEUE_TIMEOUT', 0.25)
+    app.config.setdefault('ADMISSION_RETRY_AFTER', 1)
+    app.config.setdefault('ADMISSION_LOW_PRIORITY_ENDPOINTS', [
+        'api.get_students', 'api.get_classes', 'api.get_registrations'])
+    app.config.setdefault('ADMISSION_EXEMPT_ENDPOINTS', ['api.get_changes'])
+    app.extensions['admission'] = AdmissionController(
+        app.config['ADMISSION_MAX_IN_FLIGHT'],
+        app.config['ADMISSION_QUEUE_SIZE'],
+        app.config['ADMISSION_QUEUE_TIMEOUT'])
+
+
+def request_priority():
+    """Reads of single resources have priority over writes and over the
+    collections, which are more expensive to render."""
+    if request.method not in ('GET', 'HEAD') or request.endpoint in \
+            current_app.config['ADMISSION_LOW_PRIORITY_ENDPOINTS']:
+        return LOW
+    return HIGH
+
+
+def admit():
+    """Request hook that waits for a slot, or rejects the request with a 503
+    response when the process is overloaded."""
+    controller = current_app.extensions.get('admission')
+    if controller is None or request.endpoint in \
+            current_app.config['ADMISSION_EXEMPT_ENDPOINTS']:
+        return
+    priority = request_priority()
+    if not controller.acquire(priority):
+        count('admission_rejections_total',
+              priority='high' if priority == HIGH else 'low')
+        rv = service_unavailable('the server is overloaded')
+        rv.headers['Retry-After'] = \
+            str(current_app.config['ADMISSION_RETRY_AFTER'])
+        return rv
+    g.admitted = True
+
+
+def release(exc=None):
+    if getattr(g, 'admitted', False):
+        g.admitted = False
+        current_app.extensions['admission'].release()
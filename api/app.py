@@ -9,13 +9,50 @@ def create_app(config_module=None):
                            os.environ.get('FLASK_CONFIG') or
                            'config')
 
+    app.config.setdefault('CHANGES_MAX_WAIT', 30)
+    app.config.setdefault('CHANGES_POLL_INTERVAL', 0.5)
+    app.config.setdefault('BULK_CHUNK_SIZE', 500)
+    app.config.setdefault('REGISTRATION_SHARDS', [])
     db.init_app(app)
 
+    if app.config['USE_SHARED_CACHE']:
+        from . import shared_cache
+        shared_cache.init_app(app)
+
+    if app.config['USE_METRICS']:
+        from . import metrics
+        metrics.init_app(app)
+
+    if app.config['USE_COMPRESSION']:
+        from . import compress
+        compress.init_app(app)
+
+    if app.config['USE_REQUEST_COALESCING']:
+        from . import coalesce
+        coalesce.init_app(app)
+
+    if app.config['USE_ADMISSION_CONTROL']:
+        from . import admission
+        admission.init_app(app)
+
+    from .rate_limit import RateLimiter
+    RateLimiter(app)
+
     from api.v1_0 import api as api_blueprint
     app.register_blueprint(api_blueprint, url_prefix='/api/v1.0')
 
     if app.config['USE_TOKEN_AUTH']:
+        from . import revocation
+        revocation.init_app(app)
         from api.token import token as token_blueprint
         app.register_blueprint(token_blueprint, url_prefix='/auth')
+
+    if app.config['USE_IDEMPOTENCY_KEYS']:
+        from . import idempotency
+        idempotency.init_app(app)
+
+    if app.config['WARMUP_ON_STARTUP']:
+        from .warmup import warm_up
+        warm_up(app)
     return app
 
@@ -1,7 +1,8 @@
 from flask import current_app, g
 from flask.ext.httpauth import HTTPBasicAuth
-from .models import User
+from .models import User, lookup
 from .errors import unauthorized
+from .helpers import count
 
 auth = HTTPBasicAuth()
 
@@ -11,13 +12,16 @@ def verify_password(username_or_token, password):
     if current_app.config['USE_TOKEN_AUTH']:
         # token authentication
         g.user = User.verify_auth_token(username_or_token)
+        g.auth_token = username_or_token if g.user is not None else None
         return g.user is not None
     else:
         # username/password authentication
-        g.user = User.query.filter_by(username=username_or_token).first()
+        g.auth_token = None
+        g.user = lookup(User, username=username_or_token)
         return g.user is not None and g.user.verify_password(password)
 
 
 @auth.error_handler
 def unauthorized_error():
+    count('auth_failures_total')
     return unauthorized('Please authenticate to access this API')
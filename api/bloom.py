@@ -0,0 +1,31 @@
+import hashlib
+import math
+
+
+class BloomFilter(object):
+    """Set membership test with no false negatives and a bounded rate of
+    false positives, in a fixed amount of memory."""
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) /
+                                         math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / float(capacity) *
+                                       math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        digest = hashlib.md5(key).hexdigest()
+        h1 = int(digest[:16], 16)
+        h2 = int(digest[16:], 16)
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
@@ -0,0 +1,97 @@
+import json
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from .models import db, Registration, Change
+from .errors import ValidationError
+from .sharding import add_registration, get_registration
+
+duplicate_registration = 'Student is already registered in this class'
+
+
+def iter_ndjson(stream):
+    """Parse a newline delimited JSON stream one line at a time. Yields
+    (line number, object) tuples."""
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line.decode('utf-8'))
+        except ValueError:
+            raise ValidationError('Invalid JSON in line %d' % number)
+        if not isinstance(data, dict):
+            raise ValidationError('Line %d: expected a JSON object' % number)
+        yield number, data
+
+
+def flush_chunk(items):
+    db.session.flush()
+    for item in items:
+        if isinstance(item, Registration):
+            item.update_counts(1)
+        Change.record('create', item)
+    db.session.flush()
+    for item in items:
+        if item in db.session:
+            db.session.expunge(item)
+
+
+def existing_registration(items, numbers):
+    """Return the line number of the first registration in `items` that
+    is already in the database, or `None`."""
+    for item, number in zip(items, numbers):
+        if get_registration(item.student_id, item.class_id) is not None:
+            return number
+
+
+def bulk_create(model, stream):
+    """Create one item of `model` for each line of a newline delimited
+    JSON stream, in a single transaction.
+
+    The items are validated and flushed to the database in chunks of
+    BULK_CHUNK_SIZE, so memory usage does not depend on the size of the
+    request, apart from the IDs of the registrations, which are kept to
+    find duplicates. If an item is invalid nothing is created and the
+    error is reported with the line number of the item. Returns the number
+    of items created.
+    """
+    chunk_size = current_app.config['BULK_CHUNK_SIZE']
+    add = add_registration if model is Registration else db.session.add
+    count = 0
+    items = []
+    numbers = []
+    registrations = set()
+    try:
+        for number, data in iter_ndjson(stream):
+            try:
+                item = model().from_json(data)
+                if model is Registration:
+                    ids = (item.student_id, item.class_id)
+                    if ids in registrations:
+                        raise ValidationError(duplicate_registration)
+                    registrations.add(ids)
+            except ValidationError as e:
+                raise ValidationError('Line %d: %s' % (number, e.args[0]))
+            items.append(item)
+            numbers.append(number)
+            add(item)
+            if len(items) == chunk_size:
+                flush_chunk(items)
+                count += len(items)
+                items = []
+                numbers = []
+        flush_chunk(items)
+        count += len(items)
+        db.session.commit()
+    except IntegrityError:
+        # registrations that are already in the database are only found
+        # when the chunk that has them is written
+        db.session.rollback()
+        number = existing_registration(items, numbers)
+        if number is None:
+            raise
+        raise ValidationError('Line %d: %s' % (number,
+                                               duplicate_registration))
+    except Exception:
+        db.session.rollback()
+        raise
+    return count
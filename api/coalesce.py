@@ -0,0 +1,71 @@
+import threading
+from flask import current_app, request
+from .helpers import count
+
+
+class Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Run a function once for all the concurrent callers that use the same
+    key. The callers that arrive while the function runs wait for it and
+    receive the same result, or the same exception."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, f):
+        """Return a (result, shared) tuple. `shared` is `True` when the
+        result was computed for another caller."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = f()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+
+def init_app(app):
+    app.extensions['coalescing'] = SingleFlight()
+
+
+def shared_response(f, *args, **kwargs):
+    """Return the response of view function `f`. Concurrent requests for the
+    same resource wait for a single call to `f` and get copies of its
+    response.
+
+    Resources are identified by view function, view arguments and query
+    string. The representations only differ in the URL root of the links
+    they contain, since they are always JSON and compression is applied
+    later to each response, so the URL root completes the key.
+    """
+    key = (f, args, tuple(sorted(kwargs.items())), request.query_string,
+           request.url_root)
+
+    def render():
+        rv = f(*args, **kwargs)
+        return rv.get_data(), rv.status_code, list(rv.headers)
+
+    (data, status, headers), shared = \
+        current_app.extensions['coalescing'].do(key, render)
+    count('coalesced_requests_total' if shared
+          else 'coalescing_leaders_total', endpoint=request.endpoint or 'none')
+    return current_app.response_class(data, status=status, headers=headers)
@@ -0,0 +1,103 @@
+import gzip
+import io
+import re
+import threading
+from collections import OrderedDict
+from flask import request, current_app
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+etag_encoding_re = re.compile(r'-(gzip|br)"$')
+
+
+def gzip_compress(data, level):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def brotli_compress(data, level):
+    return brotli.compress(data, quality=min(level, 11))
+
+
+compressors = OrderedDict()
+if brotli is not None:
+    compressors['br'] = brotli_compress
+compressors['gzip'] = gzip_compress
+
+
+def base_etag(etag):
+    """Return the entity tag without the content encoding suffix that is
+    added to the compressed variants of a response."""
+    return etag_encoding_re.sub('"', etag)
+
+
+class CompressionCache(object):
+    """Bounded LRU cache of compressed response bodies, indexed by entity
+    tag and content encoding."""
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.pop(key, None)
+            if data is not None:
+                self.entries[key] = data
+            return data
+
+    def set(self, key, data):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = data
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESSION_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESSION_LEVEL', 6)
+    app.config.setdefault('COMPRESSION_CACHE_SIZE', 1024)
+    app.extensions['compression'] = CompressionCache(
+        app.config['COMPRESSION_CACHE_SIZE'])
+    app.after_request(compress_response)
+
+
+def compress_response(response):
+    if not current_app.config['USE_COMPRESSION'] or \
+            response.status_code < 200 or response.status_code >= 300 or \
+            response.direct_passthrough or response.is_streamed or \
+            'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESSION_MIN_SIZE']:
+        return response
+    encoding = request.accept_encodings.best_match(list(compressors))
+    if encoding is None:
+        return response
+
+    # compressed bodies of cacheable responses are stored next to their
+    # entity tag, so that repeated requests do not compress again
+    etag = response.headers.get('ETag')
+    cache = None
+    compressed = None
+    if etag is not None and request.method in ['HEAD', 'GET']:
+        cache = current_app.extensions['compression']
+        compressed = cache.get((etag, encoding))
+    if compressed is None:
+        compressed = compressors[encoding](
+            data, current_app.config['COMPRESSION_LEVEL'])
+        if cache is not None:
+            cache.set((etag, encoding), compressed)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag is not None:
+        response.headers['ETag'] = etag[:-1] + '-' + encoding + '"'
+    return response
@@ -1,8 +1,13 @@
 import functools
 import hashlib
+import time
+from datetime import datetime
 from flask import jsonify, request, url_for, current_app, make_response, g
-from .rate_limit import RateLimit
-from .errors import too_many_requests, precondition_failed, not_modified
+from .rate_limit import get_limiter
+from .errors import too_many_requests, precondition_failed, not_modified, \
+    bad_request, conflict, unprocessable_entity
+from .helpers import count
+from .models import Change
 
 
 def json(f):
@@ -26,23 +31,47 @@ def json(f):
     return wrapped
 
 
-def rate_limit(limit, per, scope_func=lambda: request.remote_addr):
+def user_scope():
+    """Rate limit scope of the authenticated user, or of the client address
+    for requests that are not authenticated."""
+    user = getattr(g, 'user', None)
+    if user is None:
+        return request.remote_addr
+    return 'user-%d' % user.id
+
+
+def address_scope():
+    return 'address-%s' % request.remote_addr
+
+
+def endpoint_cost():
+    return current_app.config['RATE_LIMIT_COSTS'].get(request.endpoint, 1)
+
+
+def rate_limit(limits=None, scope_func=lambda: request.remote_addr,
+               cost_func=lambda: 1, limits_config='RATE_LIMITS'):
+    """Apply one or more (limit, per) rate limit tiers to a view. When
+    `limits` is not given the tiers are taken from the configuration
+    variable named by `limits_config`. When rate limits are nested, the
+    headers of the response describe the one with fewest remaining
+    requests."""
     def decorator(f):
         @functools.wraps(f)
         def wrapped(*args, **kwargs):
             if current_app.config['USE_RATE_LIMITS']:
                 key = 'rate-limit/%s/%s/' % (f.__name__, scope_func())
-                limiter = RateLimit(key, limit, per)
+                limiter = get_limiter().hit(
+                    key, limits or current_app.config[limits_config],
+                    cost_func())
                 if not limiter.over_limit:
                     rv = f(*args, **kwargs)
                 else:
+                    count('rate_limit_rejections_total',
+                          endpoint=request.endpoint)
                     rv = too_many_requests('You have exceeded your request rate')
-                #rv = make_response(rv)
-                g.headers = {
-                    'X-RateLimit-Remaining': str(limiter.remaining),
-                    'X-RateLimit-Limit': str(limiter.limit),
-                    'X-RateLimit-Reset': str(limiter.reset)
-                }
+                inner = getattr(g, 'rate_limit', None)
+                if inner is None or limiter.remaining < inner.remaining:
+                    g.rate_limit = limiter
                 return rv
             else:
                 return f(*args, **kwargs)
@@ -50,7 +79,9 @@ def rate_limit(limit, per, scope_func=lambda: request.remote_addr):
     return decorator
 
 
-def paginate(max_per_page=10):
+def paginate(max_per_page=10, query_args=()):
+    """Paginate the query returned by a view. The navigation links keep
+    the query string arguments listed in `query_args`."""
     def decorator(f):
         @functools.wraps(f)
         def wrapped(*args, **kwargs):
@@ -61,24 +92,27 @@ def paginate(max_per_page=10):
             p = query.paginate(page, per_page)
             pages = {'page': page, 'per_page': per_page,
                      'total': p.total, 'pages': p.pages}
+            args = dict((key, request.args[key]) for key in query_args
+                        if key in request.args)
+            args.update(kwargs)
             if p.has_prev:
                 pages['prev'] = url_for(request.endpoint, page=p.prev_num,
                                         per_page=per_page,
-                                        _external=True, **kwargs)
+                                        _external=True, **args)
             else:
                 pages['prev'] = None
             if p.has_next:
                 pages['next'] = url_for(request.endpoint, page=p.next_num,
                                         per_page=per_page,
-                                        _external=True, **kwargs)
+                                        _external=True, **args)
             else:
                 pages['next'] = None
             pages['first'] = url_for(request.endpoint, page=1,
                                      per_page=per_page, _external=True,
-                                     **kwargs)
+                                     **args)
             pages['last'] = url_for(request.endpoint, page=p.pages,
                                     per_page=per_page, _external=True,
-                                    **kwargs)
+                                    **args)
             return jsonify({
                 'urls': [item.get_url() for item in p.items],
                 'meta': pages
@@ -103,25 +137,159 @@ def no_cache(f):
     return cache_control('no-cache', 'no-store', 'max-age=0')(f)
 
 
+def request_etags(header):
+    """Return the entity tags listed in a conditional request header. With
+    compression enabled the tags of the compressed variants of a response
+    are reduced to the tag of the response."""
+    tags = [tag.strip() for tag in header.split(',')]
+    if current_app.config['USE_COMPRESSION']:
+        from .compress import base_etag
+        tags = [base_etag(tag) for tag in tags]
+    return tags
+
+
 def etag(f):
+    def render(*args, **kwargs):
+        rv = make_response(f(*args, **kwargs))
+        rv.headers['ETag'] = '"' + hashlib.md5(rv.get_data()).hexdigest() + '"'
+        return rv
+
     @functools.wraps(f)
     def wrapped(*args, **kwargs):
         # only for HEAD and GET requests
         assert request.method in ['HEAD', 'GET'],\
             '@etag is only supported for GET requests'
-        rv = f(*args, **kwargs)
-        rv = make_response(rv)
-        etag = '"' + hashlib.md5(rv.get_data()).hexdigest() + '"'
-        rv.headers['ETag'] = etag
+        cache = current_app.extensions.get('shared_cache')
+        rv = None
+        if cache is not None:
+            from .shared_cache import RESPONSES
+            # the responses are stored with their entity tags, valid until
+            # the next change made through the API, or until they expire
+            key = request.url.encode('utf-8')
+            version = cache.version(RESPONSES)
+            cached = cache.get(RESPONSES, key)
+            if cached is not None:
+                etag, data = cached.split(b'\n', 1)
+                rv = current_app.response_class(
+                    data, mimetype='application/json',
+                    headers={'ETag': etag.decode('utf-8')})
+        if rv is None:
+            if current_app.config['USE_REQUEST_COALESCING']:
+                from .coalesce import shared_response
+                rv = shared_response(render, *args, **kwargs)
+            else:
+                rv = render(*args, **kwargs)
+            if cache is not None and rv.status_code == 200:
+                cache.set(RESPONSES, key, rv.headers['ETag'].encode('utf-8') +
+                          b'\n' + rv.get_data(), version,
+                          expires=time.time() +
+                          current_app.config['SHARED_CACHE_RESPONSE_TTL'])
+        etag = rv.headers['ETag']
         if_match = request.headers.get('If-Match')
         if_none_match = request.headers.get('If-None-Match')
         if if_match:
-            etag_list = [tag.strip() for tag in if_match.split(',')]
+            etag_list = request_etags(if_match)
             if etag not in etag_list and '*' not in etag_list:
                 rv = precondition_failed()
         elif if_none_match:
-            etag_list = [tag.strip() for tag in if_none_match.split(',')]
+            etag_list = request_etags(if_none_match)
             if etag in etag_list or '*' in etag_list:
+                count('etag_not_modified_total', endpoint=request.endpoint)
                 rv = not_modified()
         return rv
     return wrapped
+
+
+def last_modified(get_timestamp=None):
+    """Add a Last-Modified header to the responses of a GET view, with the
+    time returned by `get_timestamp`, which is called with the arguments of
+    the view. When `get_timestamp` is not given the time of the last change
+    is used, which applies to collections. Requests with an
+    If-Modified-Since header that is not older are answered with a 304
+    status code without calling the view.
+
+    HTTP dates have a resolution of one second, so a resource modified in
+    the current second could be modified again within the same second
+    without its date changing. Its responses have no Last-Modified header
+    and are never answered with a 304 on the date alone, which leaves the
+    decision to the ETag."""
+    get_timestamp = get_timestamp or (lambda **kwargs: Change.last_modified())
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            timestamp = get_timestamp(*args, **kwargs)
+            if timestamp is not None:
+                timestamp = timestamp.replace(microsecond=0)
+                if timestamp >= datetime.utcnow().replace(microsecond=0):
+                    timestamp = None
+            if timestamp is not None:
+                if_modified_since = request.if_modified_since
+                # If-None-Match takes precedence over If-Modified-Since
+                if if_modified_since is not None and \
+                        'If-None-Match' not in request.headers and \
+                        timestamp <= if_modified_since:
+                    count('last_modified_not_modified_total',
+                          endpoint=request.endpoint)
+                    rv = not_modified()
+                    rv.last_modified = timestamp
+                    return rv
+            rv = make_response(f(*args, **kwargs))
+            if timestamp is not None and rv.status_code == 200:
+                rv.last_modified = timestamp
+            return rv
+        return wrapped
+    return decorator
+
+
+def idempotent(f):
+    """Make a POST view safe to retry. When the request has an
+    Idempotency-Key header the response is stored, and requests that repeat
+    the key receive the stored response without running the view. Requests
+    that fail with an error are not stored, so they can be retried."""
+    @functools.wraps(f)
+    def wrapped(*args, **kwargs):
+        store = current_app.extensions.get('idempotency')
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if store is None or idempotency_key is None:
+            return f(*args, **kwargs)
+        from . import idempotency
+        if not idempotency_key or len(idempotency_key) > 255:
+            return bad_request('invalid idempotency key')
+        key = idempotency.storage_key(idempotency_key)
+        fingerprint = idempotency.fingerprint()
+
+        def stored_response():
+            stored = store.get(key)
+            if stored is None:
+                return None
+            if stored['fingerprint'] != fingerprint:
+                return unprocessable_entity(
+                    'idempotency key used for a different request')
+            count('idempotent_replays_total', endpoint=request.endpoint)
+            return idempotency.replay(stored)
+
+        rv = stored_response()
+        if rv is not None:
+            return rv
+        if not store.lock(key):
+            # the response might have been stored since it was checked
+            rv = stored_response()
+            if rv is not None:
+                return rv
+            count('idempotency_conflicts_total', endpoint=request.endpoint)
+            rv = conflict('a request with this idempotency key is in '
+                          'progress')
+            rv.headers['Retry-After'] = '1'
+            return rv
+        try:
+            rv = make_response(f(*args, **kwargs))
+        except:
+            store.unlock(key)
+            raise
+        if rv.status_code < 500:
+            store.save(key, fingerprint, rv)
+        else:
+            store.unlock(key)
+        return rv
+    return wrapped
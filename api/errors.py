@@ -39,14 +39,35 @@ def not_found(message):
     return response
 
 
+def conflict(message):
+    response = jsonify({'status': 409, 'error': 'conflict',
+                        'message': message})
+    response.status_code = 409
+    return response
+
+
 def precondition_failed():
     response = jsonify({'status': 412, 'error': 'precondition failed'})
     response.status_code = 412
     return response
 
 
+def unprocessable_entity(message):
+    response = jsonify({'status': 422, 'error': 'unprocessable entity',
+                        'message': message})
+    response.status_code = 422
+    return response
+
+
 def too_many_requests(message, limit=None):
     response = jsonify({'status': 429, 'error': 'too many requests',
                         'message': message})
     response.status_code = 429
     return response
+
+
+def service_unavailable(message):
+    response = jsonify({'status': 503, 'error': 'service unavailable',
+                        'message': message})
+    response.status_code = 503
+    return response
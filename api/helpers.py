@@ -1,3 +1,4 @@
+from flask import current_app
 from flask.globals import _app_ctx_stack, _request_ctx_stack
 from werkzeug.urls import url_parse
 from werkzeug.exceptions import NotFound
@@ -33,3 +34,11 @@ def args_from_url(url, endpoint):
     if r[0] != endpoint:
         return NotFound()
     return r[1]
+
+
+def count(name, **labels):
+    """Increment a counter of the current application, if it has metrics
+    enabled. The metrics module is only loaded when they are."""
+    metrics = current_app.extensions.get('metrics')
+    if metrics is not None:
+        metrics.inc(name, tuple(sorted(labels.items())))
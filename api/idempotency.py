@@ -0,0 +1,79 @@
+import hashlib
+import json
+from flask import Response, request, g
+from .redis_client import get_redis
+
+
+class IdempotencyStore(object):
+    """Responses of requests sent with an Idempotency-Key header.
+
+    The first response for a key is stored in Redis for `ttl` seconds,
+    together with a fingerprint of the request, and is returned again for
+    retries of the request. While a request is in progress its key is
+    locked with SET NX, so a duplicate that arrives at the same time is
+    rejected instead of running the request a second time. The lock
+    expires after `lock_timeout` seconds in case the process that holds it
+    dies.
+    """
+    def __init__(self, ttl, lock_timeout):
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    def get(self, key):
+        data = get_redis().get(key)
+        if data is None:
+            return None
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    def lock(self, key):
+        return bool(get_redis().set(key + '/lock', '1', ex=self.lock_timeout,
+                                    nx=True))
+
+    def unlock(self, key):
+        get_redis().delete(key + '/lock')
+
+    def save(self, key, fingerprint, response):
+        data = json.dumps({
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'location': response.headers.get('Location'),
+            'body': response.get_data().decode('utf-8')})
+        p = get_redis().pipeline()
+        p.set(key, data, ex=self.ttl)
+        p.delete(key + '/lock')
+        p.execute()
+
+
+def init_app(app):
+    app.config.setdefault('IDEMPOTENCY_KEY_TTL', 86400)
+    app.config.setdefault('IDEMPOTENCY_LOCK_TIMEOUT', 30)
+    app.extensions['idempotency'] = IdempotencyStore(
+        app.config['IDEMPOTENCY_KEY_TTL'],
+        app.config['IDEMPOTENCY_LOCK_TIMEOUT'])
+
+
+def storage_key(idempotency_key):
+    # keys are chosen by the clients, so each user has their own
+    user = getattr(g, 'user', None)
+    return 'idempotency/%s/%s' % (user.id if user is not None else '',
+                                  idempotency_key)
+
+
+def fingerprint():
+    """Return a hash of the request, used to detect keys that are reused for
+    a different request."""
+    h = hashlib.sha1()
+    h.update(request.method.encode('utf-8'))
+    h.update(request.path.encode('utf-8'))
+    h.update(request.get_data())
+    return h.hexdigest()
+
+
+def replay(stored):
+    headers = {'Idempotent-Replayed': 'true'}
+    if stored['location']:
+        headers['Location'] = stored['location']
+    return Response(stored['body'], status=stored['status'], headers=headers,
+                    mimetype='application/json')
@@ -0,0 +1,209 @@
+import csv
+import json
+import time
+from datetime import datetime
+from sqlalchemy import select
+from .models import db, Student, Class, Registration, Change, \
+    recount_registrations
+from . import sharding
+
+# tables that can be imported, in dependency order
+tables = [('students', Student.__table__),
+          ('classes', Class.__table__),
+          ('registrations', Registration.__table__)]
+
+# resource names of the tables in the change feed
+resources = {'students': 'student', 'classes': 'class',
+             'registrations': 'registration'}
+
+datetime_formats = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                    '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S']
+
+
+def parse_datetime(value):
+    for fmt in datetime_formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Invalid timestamp: ' + value)
+
+
+def converters(table):
+    rv = {}
+    for column in table.columns:
+        if isinstance(column.type, db.Integer):
+            rv[column.key] = int
+        elif isinstance(column.type, db.DateTime):
+            rv[column.key] = parse_datetime
+        else:
+            rv[column.key] = lambda value: value
+    return rv
+
+
+def read_records(path):
+    """Stream the records in a CSV file with a header row or in a newline
+    delimited JSON file, one dictionary at a time."""
+    with open(path) as f:
+        if path.endswith('.csv'):
+            for record in csv.DictReader(f):
+                yield record
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def defaults(table):
+    """Return functions that give the value of each column for records
+    that do not have one, which is the default of the column or `None`."""
+    rv = {}
+    for column in table.columns:
+        default = column.default
+        if default is None:
+            rv[column.key] = lambda: None
+        elif default.is_callable:
+            rv[column.key] = lambda default=default: default.arg(None)
+        else:
+            rv[column.key] = lambda default=default: default.arg
+    return rv
+
+
+def read_rows(path, table):
+    """Stream the records of a file as rows of `table`. All the rows have
+    every column of the table, so that they can be inserted together."""
+    convert = converters(table)
+    default = defaults(table)
+    for record in read_records(path):
+        row = {}
+        for key in convert:
+            value = record.get(key)
+            if value in (None, ''):
+                row[key] = default[key]()
+            else:
+                row[key] = convert[key](value)
+        yield row
+
+
+def read_chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def record_import(connection, name):
+    """Add a single change for all the rows imported into a table, so that
+    the import appears in the change feed and updates the modification
+    time of the collections."""
+    connection.execute(Change.__table__.insert().values(
+        timestamp=datetime.utcnow(), action='import',
+        resource=resources[name]))
+
+
+def check_references(chunk):
+    """Check that the students and classes of a chunk of registrations
+    exist in the main database. The shards do not have foreign keys, so
+    without this check they would store registrations that reference
+    nothing."""
+    for key, table in [('student_id', Student.__table__),
+                       ('class_id', Class.__table__)]:
+        ids = sorted(set(row[key] for row in chunk))
+        found = set()
+        for i in range(0, len(ids), 500):
+            found.update(row[0] for row in db.engine.execute(
+                select([table.c.id]).where(table.c.id.in_(ids[i:i + 500]))))
+        missing = [id for id in ids if id not in found]
+        if missing:
+            raise ValueError('Invalid %s: %d' % (key, missing[0]))
+
+
+def import_shards(path, chunk_size, rebuild_indexes):
+    """Insert registrations into the shards that hold them, with one
+    transaction per shard. The students and classes of the registrations
+    are checked against the main database first, and a ValueError is
+    raised for those that do not exist. Returns the number of rows
+    inserted."""
+    connections = dict((bind, sharding.shard_engine(bind).connect())
+                       for bind in sharding.shards())
+    transactions = [connection.begin() for connection in connections.values()]
+    try:
+        if rebuild_indexes:
+            for connection in connections.values():
+                for index in sharding.shard_table.indexes:
+                    index.drop(connection)
+        count = 0
+        insert = sharding.shard_table.insert()
+        for chunk in read_chunks(read_rows(path, sharding.shard_table),
+                                 chunk_size):
+            check_references(chunk)
+            rows = dict((bind, []) for bind in connections)
+            for row in chunk:
+                rows[sharding.shard_for(row['student_id'])].append(row)
+            for bind, connection in connections.items():
+                if rows[bind]:
+                    connection.execute(insert, rows[bind])
+            count += len(chunk)
+        if rebuild_indexes:
+            for connection in connections.values():
+                for index in sharding.shard_table.indexes:
+                    index.create(connection)
+        for transaction in transactions:
+            transaction.commit()
+    except Exception:
+        for transaction in transactions:
+            transaction.rollback()
+        raise
+    finally:
+        for connection in connections.values():
+            connection.close()
+    return count
+
+
+def bulk_import(files, chunk_size=10000, rebuild_indexes=False):
+    """Insert the records in the given files with multi-row executes.
+
+    `files` maps a table name ("students", "classes" or "registrations")
+    to the path of its data file. All the files are imported in a single
+    transaction. When `rebuild_indexes` is set the secondary indexes of
+    the tables are dropped during the import and created again at the end.
+    When the registrations are sharded they are imported after the other
+    tables are committed, in a separate transaction for each shard.
+    Returns a list of (table name, rows, seconds) tuples.
+    """
+    stats = []
+    sharded = 'registrations' in files and sharding.shards()
+    with db.engine.begin() as connection:
+        for name, table in tables:
+            if name not in files or (name == 'registrations' and sharded):
+                continue
+            start = time.time()
+            if rebuild_indexes:
+                for index in table.indexes:
+                    index.drop(connection)
+            count = 0
+            insert = table.insert()
+            for chunk in read_chunks(read_rows(files[name], table),
+                                     chunk_size):
+                connection.execute(insert, chunk)
+                count += len(chunk)
+            if rebuild_indexes:
+                for index in table.indexes:
+                    index.create(connection)
+            record_import(connection, name)
+            stats.append((name, count, time.time() - start))
+        if 'registrations' in files and not sharded:
+            recount_registrations(connection)
+    if sharded:
+        start = time.time()
+        count = import_shards(files['registrations'], chunk_size,
+                              rebuild_indexes)
+        with db.engine.begin() as connection:
+            sharding.recount_registrations(connection)
+            record_import(connection, 'registrations')
+        stats.append(('registrations', count, time.time() - start))
+    return stats
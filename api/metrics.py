@@ -0,0 +1,348 @@
+import bisect
+import errno
+import glob
+import json
+import os
+import threading
+import time
+from flask import Response, current_app, _request_ctx_stack
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+# name: (type, help)
+metric_types = {
+    'http_requests_total': (
+        'counter', 'Requests by endpoint, method and status code.'),
+    'http_request_duration_seconds': (
+        'histogram', 'Request latency by endpoint.'),
+    'rate_limit_rejections_total': (
+        'counter', 'Requests rejected by the rate limiter.'),
+    'etag_not_modified_total': (
+        'counter', 'Conditional requests answered with 304 Not Modified.'),
+    'coalescing_leaders_total': (
+        'counter', 'Responses computed for concurrent identical requests.'),
+    'coalesced_requests_total': (
+        'counter', 'Requests that received a response computed for another '
+        'request.'),
+    'last_modified_not_modified_total': (
+        'counter', 'Requests with If-Modified-Since answered with 304 Not '
+        'Modified.'),
+    'idempotent_replays_total': (
+        'counter', 'Requests answered with the stored response of an '
+        'idempotency key.'),
+    'idempotency_conflicts_total': (
+        'counter', 'Requests rejected because another request with the same '
+        'idempotency key was in progress.'),
+    'admission_rejections_total': (
+        'counter', 'Requests rejected with 503 because the process was '
+        'overloaded.'),
+    'auth_failures_total': (
+        'counter', 'Requests rejected for missing or invalid credentials.'),
+    'db_pool_connections_total': (
+        'counter', 'Database connections opened by the pool.'),
+    'db_pool_checkouts_total': (
+        'counter', 'Database connections checked out from the pool.'),
+    'db_pool_checked_out': (
+        'gauge', 'Database connections currently checked out.'),
+}
+
+# the connection pools belong to the process, not to an application; the
+# pool listeners are installed by the first application with metrics
+pool_stats = {'connections': 0, 'checkouts': 0, 'checked_out': 0}
+pool_lock = threading.Lock()
+
+
+def on_connect(dbapi_connection, connection_record):
+    with pool_lock:
+        pool_stats['connections'] += 1
+
+
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    with pool_lock:
+        pool_stats['checkouts'] += 1
+        pool_stats['checked_out'] += 1
+
+
+def on_checkin(dbapi_connection, connection_record):
+    with pool_lock:
+        pool_stats['checked_out'] -= 1
+
+
+pool_listeners = [('connect', on_connect), ('checkout', on_checkout),
+                  ('checkin', on_checkin)]
+
+
+def listen_to_pools():
+    with pool_lock:
+        for name, listener in pool_listeners:
+            if not event.contains(Pool, name, listener):
+                event.listen(Pool, name, listener)
+
+
+def format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def merge(snapshots, buckets):
+    """Add up the counters and histograms of several snapshots that use
+    the given histogram buckets."""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        if list(snapshot['buckets']) != list(buckets):
+            continue
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = histograms.setdefault(key, [0] * len(histogram))
+            for i, value in enumerate(histogram):
+                total[i] += value
+    return counters, histograms
+
+
+def without_gauges(snapshot):
+    snapshot['counters'] = [counter for counter in snapshot['counters']
+                            if metric_types[counter[0]][0] != 'gauge']
+    return snapshot
+
+
+class Metrics(object):
+    """Counters and fixed-bucket histograms of the current process.
+
+    Metrics are indexed by name and a tuple of (label, value) pairs. The
+    histogram buckets are stored as individual counts, followed by the
+    count of the +Inf bucket and the sum of the observed values.
+    """
+    def __init__(self, buckets, directory=None, flush_interval=1):
+        self.buckets = tuple(buckets)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed = 0
+
+    def reset(self):
+        """Discard the metrics, including those of the connection pools.
+        Used by processes forked from the one that created the metrics."""
+        with self.lock:
+            self.pid = os.getpid()
+            self.counters = {}
+            self.histograms = {}
+            self.flushed = 0
+        with pool_lock:
+            for key in pool_stats:
+                pool_stats[key] = 0
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            counters = [[name, labels, value]
+                        for (name, labels), value in self.counters.items()]
+            histograms = [[name, labels, list(histogram)]
+                          for (name, labels), histogram
+                          in self.histograms.items()]
+        with pool_lock:
+            counters.append(['db_pool_connections_total', (),
+                             pool_stats['connections']])
+            counters.append(['db_pool_checkouts_total', (),
+                             pool_stats['checkouts']])
+            counters.append(['db_pool_checked_out', (),
+                             pool_stats['checked_out']])
+        return {'buckets': self.buckets, 'counters': counters,
+                'histograms': histograms}
+
+    def snapshot_path(self, pid):
+        return os.path.join(self.directory, 'metrics-%s.json' % pid)
+
+    def write(self, path, snapshot):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(path + '.tmp', path)
+
+    def flush(self):
+        """Write the metrics of this process to the metrics directory, where
+        the other processes of the server can find them."""
+        self.flushed = time.time()
+        self.write(self.snapshot_path(os.getpid()), self.snapshot())
+
+    def retire(self, pid):
+        """Add the counters and histograms of a process that exited to the
+        totals of the processes that exited before it, and remove its
+        snapshot. Its gauges are discarded. Only one process, such as the
+        master of a prefork server, should retire the other processes."""
+        path = self.snapshot_path(pid)
+        try:
+            with open(path) as f:
+                snapshot = without_gauges(json.load(f))
+        except (IOError, ValueError):
+            return
+        retired_path = self.snapshot_path('retired')
+        snapshots = [snapshot]
+        try:
+            with open(retired_path) as f:
+                snapshots.append(json.load(f))
+        except (IOError, ValueError):
+            pass
+        counters, histograms = merge(snapshots, self.buckets)
+        self.write(retired_path, {
+            'buckets': self.buckets,
+            'counters': [[name, labels, value]
+                         for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, histogram]
+                           for (name, labels), histogram
+                           in histograms.items()]})
+        os.remove(path)
+
+    def collect(self):
+        """Return the snapshots of all the processes that share the metrics
+        directory. The snapshot of this process is always current, and the
+        gauges of processes that are no longer running are left out."""
+        snapshots = [self.snapshot()]
+        if self.directory is not None:
+            own = self.snapshot_path(os.getpid())
+            for path in glob.glob(os.path.join(self.directory,
+                                                'metrics-*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (IOError, ValueError):
+                    continue
+                pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+                if pid.isdigit() and not process_alive(int(pid)):
+                    snapshot = without_gauges(snapshot)
+                snapshots.append(snapshot)
+        return snapshots
+
+    def expose(self):
+        """Render the metrics in the Prometheus text format."""
+        counters, histograms = merge(self.collect(), self.buckets)
+
+        lines = []
+        for name in sorted(metric_types):
+            type_, help_ = metric_types[name]
+            lines.append('# HELP %s %s' % (name, help_))
+            lines.append('# TYPE %s %s' % (name, type_))
+            for key in sorted(key for key in counters if key[0] == name):
+                lines.append('%s%s %s' % (name, format_labels(key[1]),
+                                          format_value(counters[key])))
+            for key in sorted(key for key in histograms if key[0] == name):
+                histogram = histograms[key]
+                cumulative = 0
+                for bound, value in zip(self.buckets + (float('inf'),),
+                                        histogram):
+                    cumulative += value
+                    lines.append('%s_bucket%s %d' % (
+                        name, format_labels(key[1], [('le', format_value(
+                            float(bound)))]), cumulative))
+                lines.append('%s_sum%s %s' % (name, format_labels(key[1]),
+                                              format_value(histogram[-1])))
+                lines.append('%s_count%s %d' % (name, format_labels(key[1]),
+                                                cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_BUCKETS', [0.005, 0.01, 0.025, 0.05, 0.1,
+                                              0.25, 0.5, 1, 2.5, 5, 10])
+    app.config.setdefault('METRICS_DIR', None)
+    app.config.setdefault('METRICS_FLUSH_INTERVAL', 1)
+    app.extensions['metrics'] = Metrics(app.config['METRICS_BUCKETS'],
+                                        app.config['METRICS_DIR'],
+                                        app.config['METRICS_FLUSH_INTERVAL'])
+    app.before_request(start_request)
+    app.after_request(end_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    listen_to_pools()
+
+
+# the request hooks use the request context directly, as going through the
+# context local proxies several times costs more than the metrics themselves
+
+def start_request():
+    ctx = _request_ctx_stack.top
+    metrics = ctx.app.extensions['metrics']
+    if metrics.pid != os.getpid():
+        # first request of a forked worker, discard the inherited counts
+        metrics.reset()
+    ctx.request.environ['metrics.start'] = time.time()
+
+
+def end_request(response):
+    ctx = _request_ctx_stack.top
+    metrics = ctx.app.extensions['metrics']
+    request = ctx.request
+    endpoint = request.endpoint or 'none'
+    metrics.inc('http_requests_total', (('endpoint', endpoint),
+                                        ('method', request.method),
+                                        ('status', str(response.status_code))))
+    start = request.environ.get('metrics.start')
+    if start is not None:
+        metrics.observe('http_request_duration_seconds',
+                        (('endpoint', endpoint),), time.time() - start)
+    if metrics.directory is not None and \
+            time.time() - metrics.flushed > metrics.flush_interval:
+        metrics.flush()
+    return response
+
+
+def flush_worker(app):
+    """Save the metrics of a worker process that is about to exit, so
+    that the requests it handled since its last flush are not lost."""
+    metrics = app.extensions.get('metrics')
+    if metrics is not None and metrics.directory is not None and \
+            metrics.pid == os.getpid():
+        metrics.flush()
+
+
+def retire_worker(app, pid):
+    """Merge the metrics of a worker process that exited into the totals
+    of the exited workers."""
+    metrics = app.extensions.get('metrics')
+    if metrics is not None and metrics.directory is not None:
+        metrics.retire(pid)
+
+
+def metrics():
+    return Response(current_app.extensions['metrics'].expose(),
+                    mimetype='text/plain; version=0.0.4')
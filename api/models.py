@@ -1,22 +1,69 @@
+import json
+import sys
+import time
+import uuid
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.exceptions import NotFound
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from flask import url_for, current_app
+from flask import url_for, current_app, abort, has_app_context
 from flask.ext.sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, bindparam, event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import object_session
 from .helpers import args_from_url
 from .errors import ValidationError
 
 db = SQLAlchemy()
 
 
-class Registration(db.Model):
-    __tablename__ = 'registrations'
-    student_id = db.Column('student_id', db.Integer,
-                           db.ForeignKey('students.id'), primary_key=True)
-    class_id = db.Column('class_id', db.Integer,
-                         db.ForeignKey('classes.id'), primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, including their ON DELETE clauses, unless
+    # they are enabled on each connection. sqlite3 is loaded by the SQLite
+    # dialect, so before that no connection can be one of its own
+    sqlite3 = sys.modules.get('sqlite3')
+    if sqlite3 is not None and isinstance(dbapi_connection,
+                                          sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+# fixed shape lookup statements and their compiled forms, which are reused
+# across requests instead of being rebuilt and recompiled by the ORM
+lookup_statements = {}
+compiled_cache = {}
+
+
+def lookup(model, **criteria):
+    """Return the first instance of `model` that matches the given column
+    values, or `None`."""
+    if not current_app.config['USE_STATEMENT_CACHE']:
+        pk = [c.key for c in model.__table__.primary_key]
+        if sorted(criteria) == sorted(pk):
+            return model.query.get(tuple(criteria[key] for key in pk))
+        return model.query.filter_by(**criteria).first()
+    key = (model, tuple(sorted(criteria)))
+    stmt = lookup_statements.get(key)
+    if stmt is None:
+        table = model.__table__
+        stmt = table.select().where(and_(*[
+            table.c[column] == bindparam(column)
+            for column in sorted(criteria)])).apply_labels()
+        lookup_statements[key] = stmt
+    return model.query.from_statement(stmt).params(**criteria) \
+        .execution_options(compiled_cache=compiled_cache).first()
+
+
+def lookup_or_404(model, **criteria):
+    rv = lookup(model, **criteria)
+    if rv is None:
+        abort(404)
+    return rv
+
+
+class RegistrationMixin(object):
+    __slots__ = ()
 
     def get_url(self):
         return url_for('api.get_registration', student_id=self.student_id,
@@ -32,40 +79,207 @@ class Registration(db.Model):
             'timestamp': self.timestamp
         }
 
-    def from_json(self, json):
+
+class StudentMixin(object):
+    __slots__ = ()
+
+    def get_url(self):
+        return url_for('api.get_student', id=self.id, _external=True)
+
+    def to_json(self):
+        return {
+            'url': self.get_url(),
+            'name': self.name,
+            'registrations': url_for('api.get_student_registrations',
+                                     id=self.id, _external=True),
+            'summary': url_for('api.get_student_summary', id=self.id,
+                               _external=True)
+        }
+
+
+class ClassMixin(object):
+    __slots__ = ()
+
+    def get_url(self):
+        return url_for('api.get_class', id=self.id, _external=True)
+
+    def to_json(self):
+        return {
+            'url': self.get_url(),
+            'name': self.name,
+            'registrations': url_for('api.get_class_registrations',
+                                     id=self.id, _external=True),
+            'summary': url_for('api.get_class_summary', id=self.id,
+                               _external=True)
+        }
+
+
+class UserMixin(object):
+    __slots__ = ()
+
+    def generate_auth_token(self, expires_in=3600):
+        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expires_in)
+        return s.dumps({'id': self.id, 'jti': uuid.uuid4().hex}) \
+            .decode('utf-8')
+
+
+class RegistrationRow(RegistrationMixin):
+    __slots__ = ('student_id', 'class_id', 'timestamp')
+
+    def __init__(self, student_id, class_id, timestamp):
+        self.student_id = student_id
+        self.class_id = class_id
+        self.timestamp = timestamp
+
+
+class StudentRow(StudentMixin):
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class ClassRow(ClassMixin):
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class UserRow(UserMixin):
+    __slots__ = ('id', 'username')
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+
+class RowQuery(db.Query):
+    """Column-only query that paginates into lightweight row objects.
+
+    The selected columns are passed positionally to the row class, so rows
+    are built without going through the identity map, attribute
+    instrumentation or eager loaded relationships."""
+    def __init__(self, row_class, columns, session=None):
+        super(RowQuery, self).__init__(columns, session=session)
+        self._row_class = row_class
+
+    def paginate(self, page, per_page=20, error_out=True):
+        p = super(RowQuery, self).paginate(page, per_page, error_out)
+        p.items = [self._row_class(*item) for item in p.items]
+        return p
+
+
+class Registration(RegistrationMixin, db.Model):
+    __tablename__ = 'registrations'
+    student_id = db.Column('student_id', db.Integer,
+                           db.ForeignKey('students.id', ondelete='CASCADE'),
+                           primary_key=True)
+    class_id = db.Column('class_id', db.Integer,
+                         db.ForeignKey('classes.id', ondelete='CASCADE'),
+                         primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # the primary key index lists the classes of each student, this index
+    # lists the students of each class
+    __table_args__ = (db.Index('ix_registrations_class_id_student_id',
+                               'class_id', 'student_id'),)
+
+    @staticmethod
+    def rows():
+        return RowQuery(RegistrationRow, [Registration.student_id,
+                                          Registration.class_id,
+                                          Registration.timestamp],
+                        session=db.session())
+
+    @staticmethod
+    def ids_from_json(json):
+        """Return the student and class IDs in the URLs of a registration,
+        without checking that the student and the class exist."""
         try:
             student_id = args_from_url(json['student'], 'api.get_student')['id']
-            self.student = Student.query.get_or_404(student_id)
         except (KeyError, NotFound):
             raise ValidationError('Invalid student URL')
         try:
             class_id = args_from_url(json['class'], 'api.get_class')['id']
-            self.class_ = Class.query.get_or_404(class_id)
         except (KeyError, NotFound):
             raise ValidationError('Invalid class URL')
+        return student_id, class_id
+
+    @staticmethod
+    def check_ids(student_id, class_id):
+        if lookup(Student, id=student_id) is None:
+            raise ValidationError('Invalid student URL')
+        if lookup(Class, id=class_id) is None:
+            raise ValidationError('Invalid class URL')
+
+    def from_json(self, json):
+        self.student_id, self.class_id = self.ids_from_json(json)
+        self.check_ids(self.student_id, self.class_id)
         return self
 
+    @staticmethod
+    def last_modified(student_id, class_id):
+        from .sharding import get_registration
+        reg = get_registration(student_id, class_id)
+        return reg.timestamp if reg is not None else None
+
+    def update_counts(self, delta):
+        """Add `delta` to the registration counts of the student and the
+        class."""
+        Student.query.filter_by(id=self.student_id).update(
+            {Student.registration_count: Student.registration_count + delta},
+            synchronize_session=False)
+        Class.query.filter_by(id=self.class_id).update(
+            {Class.registration_count: Class.registration_count + delta},
+            synchronize_session=False)
+
 
-class Student(db.Model):
+class Student(StudentMixin, db.Model):
     __tablename__ = 'students'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True)
+    registration_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, index=True)
     registrations = db.relationship(
         'Registration',
         backref=db.backref('student', lazy='joined'),
-        lazy='dynamic', cascade='all, delete-orphan')
+        lazy='dynamic', cascade='all, delete-orphan', passive_deletes=True)
 
-    def get_url(self):
-        return url_for('api.get_student', id=self.id, _external=True)
+    @staticmethod
+    def rows():
+        return RowQuery(StudentRow, [Student.id, Student.name],
+                        session=db.session())
 
-    def to_json(self):
+    @staticmethod
+    def last_modified(id):
+        return db.session.query(Student.updated_at).filter_by(id=id).scalar()
+
+    def summary(self):
+        from .sharding import registration_ids
         return {
-            'url': self.get_url(),
-            'name': self.name,
-            'registrations': url_for('api.get_student_registrations',
-                                     id=self.id, _external=True)
+            'url': url_for('api.get_student_summary', id=self.id,
+                           _external=True),
+            'student': self.get_url(),
+            'registration_count': self.registration_count,
+            'class_ids': registration_ids('class_id', student_id=self.id)
         }
 
+    def uncount_registrations(self):
+        """Remove the registrations of this student from the registration
+        counts of the classes."""
+        from .sharding import update_counts
+        update_counts(Class, 'class_id', -1, student_id=self.id)
+
+    def delete_registrations(self):
+        """Delete the registrations of this student with a single statement,
+        instead of loading them and deleting them one by one."""
+        from .sharding import delete_registrations
+        self.uncount_registrations()
+        delete_registrations(student_id=self.id)
+
     def from_json(self, json):
         try:
             self.name = json['name']
@@ -74,26 +288,50 @@ class Student(db.Model):
         return self
 
 
-class Class(db.Model):
+class Class(ClassMixin, db.Model):
     __tablename__ = 'classes'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True)
+    registration_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, index=True)
     registrations = db.relationship(
         'Registration',
         backref=db.backref('class_', lazy='joined'),
-        lazy='dynamic', cascade='all, delete-orphan')
+        lazy='dynamic', cascade='all, delete-orphan', passive_deletes=True)
 
-    def get_url(self):
-        return url_for('api.get_class', id=self.id, _external=True)
+    @staticmethod
+    def rows():
+        return RowQuery(ClassRow, [Class.id, Class.name],
+                        session=db.session())
 
-    def to_json(self):
+    @staticmethod
+    def last_modified(id):
+        return db.session.query(Class.updated_at).filter_by(id=id).scalar()
+
+    def summary(self):
+        from .sharding import registration_ids
         return {
-            'url': self.get_url(),
-            'name': self.name,
-            'registrations': url_for('api.get_class_registrations',
-                                     id=self.id, _external=True)
+            'url': url_for('api.get_class_summary', id=self.id,
+                           _external=True),
+            'class': self.get_url(),
+            'registration_count': self.registration_count,
+            'student_ids': registration_ids('student_id', class_id=self.id)
         }
 
+    def uncount_registrations(self):
+        """Remove the registrations of this class from the registration
+        counts of the students."""
+        from .sharding import update_counts
+        update_counts(Student, 'student_id', -1, class_id=self.id)
+
+    def delete_registrations(self):
+        """Delete the registrations of this class with a single statement,
+        instead of loading them and deleting them one by one."""
+        from .sharding import delete_registrations
+        self.uncount_registrations()
+        delete_registrations(class_id=self.id)
+
     def from_json(self, json):
         try:
             self.name = json['name']
@@ -102,7 +340,81 @@ class Class(db.Model):
         return self
 
 
-class User(db.Model):
+collection_endpoints = {'student': 'api.get_students',
+                        'class': 'api.get_classes',
+                        'registration': 'api.get_registrations'}
+
+
+class Change(db.Model):
+    """Log of the changes made to students, classes and registrations,
+    which clients use to sync incrementally. The ID is the sync cursor."""
+    __tablename__ = 'changes'
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    action = db.Column(db.String(8))
+    resource = db.Column(db.String(16))
+    student_id = db.Column(db.Integer)
+    class_id = db.Column(db.Integer)
+
+    @staticmethod
+    def record(action, item):
+        """Add a change to the session, so that it is committed in the same
+        transaction as the change to the item."""
+        if isinstance(item, Registration):
+            change = Change(resource='registration',
+                            student_id=item.student_id,
+                            class_id=item.class_id)
+        else:
+            if item.id is None:
+                # new items are assigned an ID when they are flushed
+                db.session.flush()
+            if isinstance(item, Student):
+                change = Change(resource='student', student_id=item.id)
+            else:
+                change = Change(resource='class', class_id=item.id)
+        change.action = action
+        db.session.add(change)
+
+    @staticmethod
+    def last_modified():
+        """Return the time of the last change. Any change can modify the
+        collections, as deleting a student or a class also deletes its
+        registrations."""
+        return db.session.query(func.max(Change.timestamp)).scalar()
+
+    def get_url(self):
+        if self.action == 'import':
+            return url_for(collection_endpoints[self.resource],
+                           _external=True)
+        if self.resource == 'registration':
+            return url_for('api.get_registration', student_id=self.student_id,
+                           class_id=self.class_id, _external=True)
+        elif self.resource == 'student':
+            return url_for('api.get_student', id=self.student_id,
+                           _external=True)
+        return url_for('api.get_class', id=self.class_id, _external=True)
+
+    def to_json(self):
+        return {
+            'cursor': self.id,
+            'action': self.action,
+            'resource': self.resource,
+            'url': self.get_url(),
+            'timestamp': self.timestamp
+        }
+
+
+def recount_registrations(connection):
+    """Recalculate the registration counts of all students and classes."""
+    registrations = Registration.__table__
+    for table, column in [(Student.__table__, registrations.c.student_id),
+                          (Class.__table__, registrations.c.class_id)]:
+        connection.execute(table.update().values(
+            registration_count=select([func.count()])
+            .where(column == table.c.id).as_scalar()))
+
+
+class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True)
@@ -114,21 +426,68 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
+        from werkzeug.security import generate_password_hash
         self.password_hash = generate_password_hash(password)
 
     def verify_password(self, password):
+        from werkzeug.security import check_password_hash
         return check_password_hash(self.password_hash, password)
 
-    def generate_auth_token(self, expires_in=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expires_in)
-        return s.dumps({'id': self.id}).decode('utf-8')
-
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
+        """Return the user of a token as a `UserRow`, or `None` if the token
+        is not valid.
+
+        With the shared cache enabled, tokens that were verified recently
+        by any worker are accepted without checking their signature or
+        querying the database. Cached tokens are still checked against the
+        revocation list, and are discarded when a user is changed or
+        deleted through the application. Changes made to the users table by
+        other means are seen after SHARED_CACHE_AUTH_TTL seconds.
+        """
+        cache = current_app.extensions.get('shared_cache')
+        if cache is not None:
+            from .shared_cache import AUTH
+        key = token.encode('utf-8')
+        cached = cache.get(AUTH, key) if cache is not None else None
+        if cached is not None:
+            data = json.loads(cached.decode('utf-8'))
+        else:
+            s = Serializer(current_app.config['SECRET_KEY'])
+            try:
+                data, header = s.loads(token, return_header=True)
+            except:
+                return None
+        if current_app.config['USE_TOKEN_REVOCATION']:
+            from .revocation import is_revoked
+            if is_revoked(data.get('jti')):
+                return None
+        if cached is not None:
+            return UserRow(data['id'], data['username'])
+        version = cache.version(AUTH) if cache is not None else None
+        user = lookup(User, id=data['id'])
+        if user is None:
             return None
-        return User.query.get(data['id'])
+        if cache is not None:
+            data['username'] = user.username
+            cache.set(AUTH, key, json.dumps(data).encode('utf-8'), version,
+                      expires=min(header['exp'], time.time() +
+                                  current_app.config['SHARED_CACHE_AUTH_TTL']))
+        return UserRow(user.id, user.username)
+
+    @staticmethod
+    def revoke_auth_token(token):
+        from .revocation import revoke_token
+        s = Serializer(current_app.config['SECRET_KEY'])
+        data, header = s.loads(token, return_header=True)
+        revoke_token(data['jti'], header['exp'])
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, target):
+    # tokens of users that were changed or deleted are verified again
+    if has_app_context() and 'shared_cache' in current_app.extensions:
+        from .shared_cache import AUTH, invalidate_on_commit
+        invalidate_on_commit(object_session(target), AUTH)
 
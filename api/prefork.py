@@ -0,0 +1,189 @@
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import traceback
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+from .models import db
+from .metrics import flush_worker, retire_worker
+
+
+class RequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        if self.server.access_log:
+            WSGIRequestHandler.log_request(self, *args, **kwargs)
+
+
+class Server(WSGIServer):
+    allow_reuse_address = True
+    request_queue_size = 128
+    timeout = 1
+
+    def get_request(self):
+        # the listening socket is non-blocking so that idle workers do not
+        # hang in accept() when another worker takes the connection, but
+        # the accepted connections are handled in blocking mode
+        connection, address = WSGIServer.get_request(self)
+        connection.setblocking(True)
+        return connection, address
+
+    def process_request(self, request, client_address):
+        self.requests += 1
+        WSGIServer.process_request(self, request, client_address)
+
+
+def dispose_engines(app):
+    """Close the pooled database connections of all the engines of the
+    application, so that they are not shared with forked processes."""
+    with app.app_context():
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+            db.get_engine(app, bind).dispose()
+
+
+class PreforkServer(object):
+    """HTTP server that runs the application in a pool of worker processes.
+
+    The application is created in the master process before the workers
+    are forked, so the code and the startup state are shared between the
+    workers. All the workers accept connections on the same listening
+    socket. A worker exits after handling `max_requests` requests (if
+    given) and the master starts a new one in its place.
+
+    SIGHUP creates the application again and replaces the workers without
+    closing the listening socket; the old workers finish the requests in
+    progress before they exit. SIGTERM and SIGINT stop the server, also
+    letting the workers complete their current requests.
+    """
+    def __init__(self, app_factory, host='127.0.0.1', port=5000, workers=0,
+                 max_requests=0, graceful_timeout=30, access_log=True):
+        self.app_factory = app_factory
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.server = Server((host, port), RequestHandler)
+        self.server.socket.setblocking(False)
+        self.server.access_log = access_log
+        self.app = None
+        self.generation = 0
+        self.pids = {}
+        self.stop_requested = False
+        self.reload_requested = False
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def log(self, message, *args):
+        sys.stderr.write('[%d] %s\n' % (os.getpid(), message % args))
+
+    def handle_stop(self, signum, frame):
+        self.stop_requested = True
+
+    def handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def load_app(self):
+        app = self.app_factory()
+        # connections opened while the application was created (for
+        # example by the warm-up) must not be inherited by the workers,
+        # which open their own
+        dispose_engines(app)
+        self.app = app
+        self.server.set_app(app)
+        self.generation += 1
+
+    def run(self):
+        self.load_app()
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        self.log('Listening on http://%s:%d/ with %d workers',
+                 self.address[0], self.address[1], self.workers)
+        while not self.stop_requested:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.reap_workers()
+            self.spawn_workers()
+            time.sleep(0.1)
+        self.stop()
+
+    def reload(self):
+        self.log('Reloading')
+        try:
+            self.load_app()
+        except Exception:
+            traceback.print_exc()
+            self.log('Reload failed, keeping the current workers')
+            return
+        self.spawn_workers()
+        for pid, generation in list(self.pids.items()):
+            if generation != self.generation:
+                self.kill(pid, signal.SIGTERM)
+
+    def stop(self):
+        self.log('Stopping')
+        for pid in list(self.pids):
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self.pids and time.time() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+        for pid in list(self.pids):
+            self.kill(pid, signal.SIGKILL)
+        self.reap_workers()
+        self.server.server_close()
+
+    def kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+    def reap_workers(self):
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if pid == 0:
+                return
+            self.pids.pop(pid, None)
+            retire_worker(self.app, pid)
+
+    def spawn_workers(self):
+        running = len([generation for generation in self.pids.values()
+                       if generation == self.generation])
+        for i in range(self.workers - running):
+            pid = os.fork()
+            if pid == 0:
+                self.run_worker()
+            self.pids[pid] = self.generation
+
+    def run_worker(self):
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, self.handle_stop)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            dispose_engines(self.app)
+            if self.app.config['WARMUP_ON_STARTUP']:
+                # the connections opened by the warm-up were closed before
+                # the fork, each worker opens its own
+                from .warmup import warm_up, worker_phases
+                warm_up(self.app, worker_phases)
+            self.server.requests = 0
+            while not self.stop_requested and (
+                    not self.max_requests or
+                    self.server.requests < self.max_requests):
+                self.server.handle_request()
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            try:
+                flush_worker(self.app)
+            except Exception:
+                traceback.print_exc()
+            os._exit(status)
@@ -1,55 +1,80 @@
 import time
-from redis import Redis
 from flask import current_app
+from .redis_client import get_redis
 
-redis = None
-
-
-class FakeRedis(object):
-    """Redis mock used for testing."""
-    def __init__(self):
-        self.v = {}
-        self.last_key = None
-
-    def pipeline(self):
-        return self
-
-    def incr(self, key):
-        if self.v.get(key, None) is None:
-            self.v[key] = 0
-        self.v[key] += 1
-        self.last_key = key
-
-    def expireat(self, key, time):
-        pass
-
-    def execute(self):
-        return [self.v[self.last_key]]
 
 class RateLimit(object):
+    """Rate limit with one or more tiers, given as (limit, per) tuples.
+
+    All the tiers are counted in a single Redis round trip. The `limit`,
+    `per`, `reset` and `remaining` attributes describe the tier that has
+    the fewest remaining requests. A request is over the limit when its
+    cost takes the count of a tier past the limit of the tier.
+    """
     expiration_window = 10
 
-    def __init__(self, key_prefix, limit, per):
-        global redis
-        if redis is None and current_app.config['USE_RATE_LIMITS']:
-            if current_app.config['TESTING']:
-                redis = FakeRedis()
-            else:
-                redis = Redis()
-
-        self.reset = (int(time.time()) // per) * per + per
-        self.key = key_prefix + str(self.reset)
-        self.limit = limit
-        self.per = per
+    def __init__(self, redis, key_prefix, limits, cost=1, now=None):
+        now = int(now or time.time())
         p = redis.pipeline()
-        p.incr(self.key)
-        p.expireat(self.key, self.reset + self.expiration_window)
-        self.current = min(p.execute()[0], limit)
+        resets = []
+        for limit, per in limits:
+            reset = (now // per) * per + per
+            key = '%s%d/%d' % (key_prefix, per, reset)
+            p.incr(key, cost)
+            p.expireat(key, reset + self.expiration_window)
+            resets.append(reset)
+        counts = p.execute()[::2]
+        self.tiers = [(limit, per, reset, count)
+                      for (limit, per), reset, count
+                      in zip(limits, resets, counts)]
+        self.limit, self.per, self.reset, self.current = min(
+            self.tiers, key=lambda tier: tier[0] - tier[3])
 
     @property
     def remaining(self):
-        return self.limit - self.current
+        return max(self.limit - self.current, 0)
 
     @property
     def over_limit(self):
-        return self.current >= self.limit
+        return any(current > limit for limit, per, reset, current
+                   in self.tiers)
+
+    @property
+    def headers(self):
+        return {
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Reset': str(self.reset)
+        }
+
+
+class RateLimiter(object):
+    """Rate limiting extension.
+
+    All the state is kept in the application the extension is initialized
+    with, so several applications can run in the same process. The Redis
+    client is created under a lock the first time it is needed, after that
+    a hit only needs attribute lookups.
+    """
+    def __init__(self, app=None):
+        self.app = app
+        self.redis = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMITS', [(5, 15)])
+        app.config.setdefault('ADDRESS_RATE_LIMITS', [(50, 15)])
+        app.config.setdefault('RATE_LIMIT_COSTS', {})
+        app.extensions['rate_limit'] = self
+
+    def hit(self, key_prefix, limits=None, cost=1, now=None):
+        redis = self.redis
+        if redis is None:
+            redis = self.redis = get_redis(self.app)
+        return RateLimit(redis, key_prefix,
+                         limits or self.app.config['RATE_LIMITS'], cost, now)
+
+
+def get_limiter():
+    return current_app.extensions['rate_limit']
@@ -0,0 +1,89 @@
+import threading
+from flask import current_app
+
+lock = threading.Lock()
+
+
+class FakeRedis(object):
+    """Redis mock used for testing."""
+    def __init__(self):
+        self.v = {}
+        self.lock = threading.RLock()
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.v.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.lock:
+            if nx and key in self.v:
+                return None
+            self.v[key] = value
+            return True
+
+    def delete(self, *keys):
+        with self.lock:
+            return len([self.v.pop(key) for key in keys if key in self.v])
+
+    def incr(self, key, amount=1):
+        with self.lock:
+            self.v[key] = self.v.get(key, 0) + amount
+            return self.v[key]
+
+    def expireat(self, key, time):
+        return True
+
+    def zadd(self, key, **scores):
+        self.v.setdefault(key, {}).update(scores)
+
+    def zscore(self, key, member):
+        return self.v.get(key, {}).get(member)
+
+    def zrange(self, key, start, end):
+        members = sorted(self.v.get(key, {}).items(), key=lambda m: m[1])
+        return [m[0].encode('utf-8') for m in members]
+
+    def zremrangebyscore(self, key, min, max):
+        zset = self.v.get(key, {})
+        for member, score in list(zset.items()):
+            if min <= score <= max:
+                del zset[member]
+
+
+class FakePipeline(object):
+    """Redis pipeline mock that runs the queued commands on execute."""
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        with self.redis.lock:
+            return [command(*args, **kwargs)
+                    for command, args, kwargs in commands]
+
+
+def get_redis(app=None):
+    """Return the Redis client of the application, creating it on first
+    use."""
+    app = app or current_app._get_current_object()
+    redis = app.extensions.get('redis')
+    if redis is None:
+        with lock:
+            redis = app.extensions.get('redis')
+            if redis is None:
+                if app.config['TESTING']:
+                    redis = FakeRedis()
+                else:
+                    from redis import Redis
+                    redis = Redis()
+                app.extensions['redis'] = redis
+    return redis
@@ -0,0 +1,66 @@
+import threading
+import time
+from flask import current_app
+from .bloom import BloomFilter
+from .redis_client import get_redis
+
+
+class RevocationList(object):
+    """Denylist of revoked token IDs.
+
+    The revoked IDs are stored in a Redis sorted set scored by their
+    expiration time. Each process keeps a Bloom filter with a copy of the
+    set that is refreshed every `sync_interval` seconds, so that tokens
+    that were never revoked are accepted without contacting Redis. Only
+    tokens that hit the filter are confirmed against the sorted set.
+    """
+    key = 'revoked-tokens'
+
+    def __init__(self, capacity, sync_interval):
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        self.bloom = BloomFilter(capacity)
+        self.last_sync = 0
+        self.lock = threading.Lock()
+
+    def sync(self):
+        redis = get_redis()
+        now = time.time()
+        redis.zremrangebyscore(self.key, 0, int(now))
+        token_ids = redis.zrange(self.key, 0, -1)
+        bloom = BloomFilter(max(self.capacity, 2 * len(token_ids)))
+        for token_id in token_ids:
+            bloom.add(token_id)
+        self.bloom = bloom
+        self.last_sync = now
+
+    def revoke(self, token_id, expires_at):
+        get_redis().zadd(self.key, **{token_id: expires_at})
+        self.bloom.add(token_id)
+
+    def is_revoked(self, token_id):
+        if time.time() - self.last_sync > self.sync_interval and \
+                self.lock.acquire(False):
+            try:
+                self.sync()
+            finally:
+                self.lock.release()
+        if token_id is None or token_id not in self.bloom:
+            return False
+        return get_redis().zscore(self.key, token_id) is not None
+
+
+def init_app(app):
+    app.config.setdefault('TOKEN_REVOCATION_CAPACITY', 100000)
+    app.config.setdefault('TOKEN_REVOCATION_SYNC_INTERVAL', 5)
+    app.extensions['token_revocation'] = RevocationList(
+        app.config['TOKEN_REVOCATION_CAPACITY'],
+        app.config['TOKEN_REVOCATION_SYNC_INTERVAL'])
+
+
+def revoke_token(token_id, expires_at):
+    current_app.extensions['token_revocation'].revoke(token_id, expires_at)
+
+
+def is_revoked(token_id):
+    return current_app.extensions['token_revocation'].is_revoked(token_id)
@@ -0,0 +1,105 @@
+import re
+from flask import current_app, has_app_context
+from sqlalchemy import DDL, event, false, literal_column
+from sqlalchemy.sql import table, column
+from .models import db, Student, Class
+
+token_re = re.compile(r'\w+', re.UNICODE)
+
+
+def search_state(app=None):
+    """Return the full-text search state of the application: whether each
+    of its engines has FTS5, and the search indexes known to exist."""
+    app = app or current_app._get_current_object()
+    return app.extensions.setdefault('search', {'fts5': {}, 'indexes': set()})
+
+
+def fts5_available(ddl=None, target=None, bind=None, **kwargs):
+    """Check if the SQLite library of the database has the FTS5 extension
+    compiled in."""
+    bind = bind or db.engine
+    engine = getattr(bind, 'engine', bind)
+    fts5 = search_state()['fts5']
+    if engine not in fts5:
+        fts5[engine] = engine.dialect.name == 'sqlite' and bool(bind.execute(
+            "SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+    return fts5[engine]
+
+
+def search_index_exists(model):
+    """Check if the full-text index of `model` exists. Databases created
+    before full-text search was added do not have it. Only indexes that
+    exist are remembered, so an index created later is found."""
+    engine = db.engine
+    indexes = search_state()['indexes']
+    key = (engine, model.__tablename__)
+    if key not in indexes:
+        if engine.execute("SELECT count(*) FROM sqlite_master "
+                          "WHERE type = 'table' AND name = ?",
+                          model.__tablename__ + '_fts').scalar():
+            indexes.add(key)
+        else:
+            return False
+    return True
+
+
+def forget_search_index(target, connection, **kwargs):
+    if has_app_context():
+        search_state()['indexes'].discard((connection.engine, target.name))
+
+
+def create_search_index(model):
+    """Maintain a full-text index of the `name` column of `model`.
+
+    The index is an external content FTS5 table that is kept in sync with
+    the indexed table by triggers, so rows that are created, modified or
+    deleted are reflected in the index within the same transaction.
+    """
+    name = model.__tablename__
+    statements = [
+        "CREATE VIRTUAL TABLE {0}_fts USING fts5("
+        "name, content='{0}', content_rowid='id')",
+        "CREATE TRIGGER {0}_fts_insert AFTER INSERT ON {0} BEGIN "
+        "INSERT INTO {0}_fts(rowid, name) VALUES (new.id, new.name); END",
+        "CREATE TRIGGER {0}_fts_delete AFTER DELETE ON {0} BEGIN "
+        "INSERT INTO {0}_fts({0}_fts, rowid, name) "
+        "VALUES ('delete', old.id, old.name); END",
+        "CREATE TRIGGER {0}_fts_update AFTER UPDATE OF name ON {0} BEGIN "
+        "INSERT INTO {0}_fts({0}_fts, rowid, name) "
+        "VALUES ('delete', old.id, old.name); "
+        "INSERT INTO {0}_fts(rowid, name) VALUES (new.id, new.name); END"]
+    for statement in statements:
+        event.listen(model.__table__, 'after_create',
+                     DDL(statement.format(name)).execute_if(
+                         callable_=fts5_available))
+    event.listen(model.__table__, 'after_drop',
+                 DDL('DROP TABLE IF EXISTS {0}_fts'.format(name)).execute_if(
+                     callable_=fts5_available))
+    event.listen(model.__table__, 'after_drop', forget_search_index)
+
+
+def match_expression(q):
+    """Convert search text to an FTS5 query that matches rows that have
+    all the words, each as a whole word or as a prefix."""
+    return ' '.join('"%s"*' % token for token in token_re.findall(q))
+
+
+def search(model, query, q):
+    """Filter `query` to the rows of `model` with names that match the
+    search text `q`, best matches first."""
+    if fts5_available() and search_index_exists(model):
+        match = match_expression(q)
+        if not match:
+            return query.filter(false())
+        fts = table(model.__tablename__ + '_fts', column('rowid'),
+                    column('rank'))
+        return query.join(fts, fts.c.rowid == model.id) \
+            .filter(literal_column(fts.name).op('MATCH')(match)) \
+            .order_by(fts.c.rank)
+    q = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return query.filter(model.name.like('%' + q + '%', escape='\\')) \
+        .order_by(model.name)
+
+
+create_search_index(Student)
+create_search_index(Class)
@@ -0,0 +1,241 @@
+import heapq
+from datetime import datetime
+from itertools import islice
+from flask import current_app, abort, has_app_context
+from flask.ext.sqlalchemy import Pagination
+from sqlalchemy import Table, Column, Integer, DateTime, Index, MetaData, \
+    and_, bindparam, event, func, select
+from sqlalchemy.exc import IntegrityError
+from .models import db, Student, Class, Registration, lookup
+from .errors import ValidationError
+
+# the shards store the registrations in a copy of the registrations table
+# without foreign keys, since students and classes are in another database
+shard_metadata = MetaData()
+shard_table = Table(
+    'registrations', shard_metadata,
+    Column('student_id', Integer, primary_key=True, autoincrement=False),
+    Column('class_id', Integer, primary_key=True, autoincrement=False),
+    Column('timestamp', DateTime, default=datetime.utcnow),
+    Index('ix_registrations_class_id_student_id', 'class_id', 'student_id'))
+
+
+def shards():
+    """Return the bind keys of the registration shards. When this list is
+    empty the registrations are in the main database."""
+    return current_app.config['REGISTRATION_SHARDS']
+
+
+def shard_for(student_id):
+    binds = shards()
+    return binds[student_id % len(binds)]
+
+
+def shards_for(criteria):
+    if 'student_id' in criteria:
+        return [shard_for(criteria['student_id'])]
+    return shards()
+
+
+def shard_engine(bind):
+    return db.get_engine(current_app._get_current_object(), bind)
+
+
+def execute(bind, statement):
+    """Execute a statement on a shard. The statement runs in the session's
+    transaction for that shard, which is committed or rolled back together
+    with the rest of the session."""
+    return db.session.execute(statement, bind=shard_engine(bind))
+
+
+def where(criteria):
+    return and_(*[shard_table.c[key] == value
+                  for key, value in sorted(criteria.items())])
+
+
+def is_shard(connection):
+    return has_app_context() and connection.engine in [
+        shard_engine(bind) for bind in shards()]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_shard_table(target, connection, **kwargs):
+    # db.create_all() runs for every bind, including the shards
+    if is_shard(connection):
+        shard_table.create(connection, checkfirst=True)
+
+
+@event.listens_for(db.metadata, 'after_drop')
+def drop_shard_table(target, connection, **kwargs):
+    if is_shard(connection):
+        shard_table.drop(connection, checkfirst=True)
+
+
+class ShardQuery(object):
+    """Registrations from one or more shards, in primary key order.
+
+    Only pagination is supported. The shards are counted first, so that
+    pages past the end are rejected without reading any rows. Each shard
+    then returns its rows in order, and these results are merged as they
+    are read until the end of the requested page.
+    """
+    def __init__(self, binds, criteria):
+        self.binds = binds
+        self.criteria = criteria
+
+    def paginate(self, page, per_page=20, error_out=True):
+        if error_out and page < 1:
+            abort(404)
+        count = select([func.count()]).select_from(shard_table)
+        if self.criteria:
+            count = count.where(where(self.criteria))
+        total = sum(execute(bind, count).scalar() for bind in self.binds)
+        if (page - 1) * per_page >= total:
+            if error_out and page != 1:
+                abort(404)
+            return Pagination(self, page, per_page, total, [])
+        rows = select([shard_table.c.student_id, shard_table.c.class_id,
+                       shard_table.c.timestamp]) \
+            .order_by(shard_table.c.student_id, shard_table.c.class_id) \
+            .limit(page * per_page)
+        if self.criteria:
+            rows = rows.where(where(self.criteria))
+        merged = heapq.merge(*[(tuple(row) for row in execute(bind, rows))
+                               for bind in self.binds])
+        items = [Registration(student_id=student_id, class_id=class_id,
+                              timestamp=timestamp)
+                 for student_id, class_id, timestamp
+                 in islice(merged, (page - 1) * per_page, page * per_page)]
+        return Pagination(self, page, per_page, total, items)
+
+
+def registrations(**criteria):
+    """Return a query of the registrations that match the given student_id
+    and/or class_id, which can be paginated."""
+    if not shards():
+        return Registration.rows().filter_by(**criteria)
+    return ShardQuery(shards_for(criteria), criteria)
+
+
+def get_registration(student_id, class_id):
+    if not shards():
+        return lookup(Registration, student_id=student_id, class_id=class_id)
+    row = execute(shard_for(student_id), shard_table.select().where(where(
+        {'student_id': student_id, 'class_id': class_id}))).first()
+    if row is None:
+        return None
+    return Registration(student_id=row.student_id, class_id=row.class_id,
+                        timestamp=row.timestamp)
+
+
+def get_registration_or_404(student_id, class_id):
+    rv = get_registration(student_id, class_id)
+    if rv is None:
+        abort(404)
+    return rv
+
+
+def add_registration(reg):
+    if not shards():
+        db.session.add(reg)
+        return
+    if reg.timestamp is None:
+        reg.timestamp = datetime.utcnow()
+    execute(shard_for(reg.student_id), shard_table.insert().values(
+        student_id=reg.student_id, class_id=reg.class_id,
+        timestamp=reg.timestamp))
+
+
+def insert_registration(student_id, class_id):
+    """Insert a registration with a single statement and return it.
+
+    The database rejects students and classes that do not exist with its
+    foreign keys, and duplicate registrations with the primary key, so
+    nothing is looked up before the insert. When the insert fails the
+    cause is found out, and reported as a ValidationError. The shards do
+    not have foreign keys, so with sharding the student and the class are
+    checked first.
+    """
+    reg = Registration(student_id=student_id, class_id=class_id,
+                       timestamp=datetime.utcnow())
+    values = {'student_id': student_id, 'class_id': class_id,
+              'timestamp': reg.timestamp}
+    try:
+        if not shards():
+            db.session.execute(Registration.__table__.insert().values(values))
+        else:
+            Registration.check_ids(student_id, class_id)
+            execute(shard_for(student_id), shard_table.insert().values(values))
+    except IntegrityError:
+        db.session.rollback()
+        Registration.check_ids(student_id, class_id)
+        raise ValidationError('Student is already registered in this class')
+    return reg
+
+
+def delete_registration(reg):
+    if not shards():
+        db.session.delete(reg)
+        return
+    execute(shard_for(reg.student_id), shard_table.delete().where(where(
+        {'student_id': reg.student_id, 'class_id': reg.class_id})))
+
+
+def registration_ids(key, **criteria):
+    """Return the sorted values of the `key` column of the registrations
+    that match the given criteria."""
+    if not shards():
+        column = getattr(Registration, key)
+        return [row[0] for row in db.session.query(column)
+                .filter_by(**criteria).order_by(column)]
+    column = shard_table.c[key]
+    query = select([column]).where(where(criteria)).order_by(column)
+    return list(heapq.merge(*[[row[0] for row in execute(bind, query)]
+                              for bind in shards_for(criteria)]))
+
+
+def update_counts(model, key, delta, **criteria):
+    """Add `delta` to the registration counts of the `model` rows that are
+    referenced by the `key` column of the registrations that match the
+    given criteria."""
+    values = {model.registration_count: model.registration_count + delta}
+    if not shards():
+        model.query.filter(model.id.in_(
+            db.session.query(getattr(Registration, key))
+            .filter_by(**criteria))).update(values, synchronize_session=False)
+        return
+    ids = registration_ids(key, **criteria)
+    for i in range(0, len(ids), 500):
+        model.query.filter(model.id.in_(ids[i:i + 500])).update(
+            values, synchronize_session=False)
+
+
+def delete_registrations(**criteria):
+    """Delete the registrations that match the given criteria, with one
+    statement per shard."""
+    if not shards():
+        Registration.query.filter_by(**criteria).delete(
+            synchronize_session=False)
+        return
+    for bind in shards_for(criteria):
+        execute(bind, shard_table.delete().where(where(criteria)))
+
+
+def recount_registrations(connection):
+    """Recalculate the registration counts of all students and classes from
+    the registrations in the shards."""
+    for table, key in [(Student.__table__, 'student_id'),
+                       (Class.__table__, 'class_id')]:
+        counts = {}
+        column = shard_table.c[key]
+        query = select([column, func.count()]).group_by(column)
+        for bind in shards():
+            for value, count in shard_engine(bind).execute(query):
+                counts[value] = counts.get(value, 0) + count
+        connection.execute(table.update().values(registration_count=0))
+        if counts:
+            connection.execute(
+                table.update().where(table.c.id == bindparam('_id'))
+                .values(registration_count=bindparam('_count')),
+                [{'_id': id, '_count': count}
+                 for id, count in counts.items()])
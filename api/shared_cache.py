@@ -0,0 +1,216 @@
+import hashlib
+import mmap
+import multiprocessing
+import struct
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# namespaces, each with its own version
+AUTH, RESPONSES = 0, 1
+NAMESPACES = 8
+
+# seq, key hash, version, expiration time, namespace, key and value lengths
+SLOT = struct.Struct('<QQQdBxHI')
+SEQ = struct.Struct('<Q')
+VERSIONS = struct.Struct('<%dQ' % NAMESPACES)
+PROBES = 8
+# seconds to wait for the lock, which is never released if a process is
+# killed while it holds it
+LOCK_TIMEOUT = 0.1
+
+
+def key_hash(key):
+    # the hash must be the same in all the processes, so hash() cannot be
+    # used, and zero marks empty slots
+    return SEQ.unpack(hashlib.md5(key).digest()[:8])[0] | 1
+
+
+class SharedCache(object):
+    """Key/value cache in a shared memory segment.
+
+    The segment is mapped when the application is created, so it is shared
+    by all the worker processes forked from it. It is split into `slots`
+    slots of `slot_size` bytes, each holding one entry with its key and
+    value. A key can be in any of the `PROBES` slots that follow the
+    position given by its hash. When they are all used, one is evicted with
+    the CLOCK algorithm: a slot is taken unless it was read since the clock
+    last passed over it.
+
+    Entries are stamped with the version of their namespace, and
+    `invalidate()` discards all the entries of a namespace at once by
+    incrementing the version. Writers take an inter-process lock. Readers
+    do not lock; each slot has a sequence number that is odd while the slot
+    is written, and a reader retries if the sequence number changed while
+    it was reading. If the lock cannot be taken within `LOCK_TIMEOUT`
+    seconds, values are not stored and invalidations increment the version
+    without it.
+    """
+    def __init__(self, slots, slot_size):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.refs = VERSIONS.size + 8
+        self.base = self.refs + slots
+        self.mm = mmap.mmap(-1, self.base + slots * slot_size)
+        self.lock = multiprocessing.Lock()
+
+    def version(self, namespace):
+        return SEQ.unpack_from(self.mm, namespace * SEQ.size)[0]
+
+    def invalidate(self, namespace):
+        locked = self.lock.acquire(True, LOCK_TIMEOUT)
+        try:
+            offset = namespace * SEQ.size
+            SEQ.pack_into(self.mm, offset,
+                          SEQ.unpack_from(self.mm, offset)[0] + 1)
+        finally:
+            if locked:
+                self.lock.release()
+
+    def probe(self, h):
+        start = h % self.slots
+        if start + PROBES <= self.slots:
+            return range(start, start + PROBES)
+        return [(start + i) % self.slots for i in range(PROBES)]
+
+    def get(self, namespace, key, now=None):
+        """Return the value of `key`, or `None` if it is not in the cache,
+        if it expired or if its namespace was invalidated after it was
+        stored."""
+        h = key_hash(key)
+        mm = self.mm
+        for index in self.probe(h):
+            offset = self.base + index * self.slot_size
+            for attempt in range(3):
+                seq, slot_hash, version, expires, slot_namespace, key_len, \
+                    value_len = SLOT.unpack_from(mm, offset)
+                if seq & 1:
+                    continue
+                if slot_hash != h:
+                    break
+                start = offset + SLOT.size
+                data = mm[start:start + key_len + value_len]
+                if SEQ.unpack_from(mm, offset)[0] == seq:
+                    break
+            else:
+                # the slot is being written, consider it a miss
+                return None
+            if slot_hash != h or data[:key_len] != key:
+                continue
+            if slot_namespace != namespace or \
+                    version != self.version(namespace) or \
+                    (expires and expires < (now or time.time())):
+                return None
+            mm[self.refs + index:self.refs + index + 1] = b'\x01'
+            return data[key_len:]
+        return None
+
+    def set(self, namespace, key, value, version=None, expires=0):
+        """Store `value` under `key`. `version` is the version of the
+        namespace that was current when the value was computed; if the
+        namespace was invalidated since then the value is not stored.
+        Returns `True` if the value was stored."""
+        if SLOT.size + len(key) + len(value) > self.slot_size:
+            return False
+        h = key_hash(key)
+        if not self.lock.acquire(True, LOCK_TIMEOUT):
+            return False
+        try:
+            versions = VERSIONS.unpack_from(self.mm, 0)
+            if version is None:
+                version = versions[namespace]
+            elif version != versions[namespace]:
+                return False
+            now = time.time()
+            candidates = self.probe(h)
+            index = None
+            for i in candidates:
+                seq, slot_hash, slot_version, slot_expires, slot_namespace, \
+                    key_len, value_len = SLOT.unpack_from(
+                        self.mm, self.base + i * self.slot_size)
+                start = self.base + i * self.slot_size + SLOT.size
+                if slot_hash == h and \
+                        self.mm[start:start + key_len] == key:
+                    index = i
+                    break
+                if index is None and (
+                        slot_hash == 0 or
+                        slot_version != versions[slot_namespace] or
+                        (slot_expires and slot_expires < now)):
+                    index = i
+            if index is None:
+                index = self.evict(candidates)
+            self.write(index, h, namespace, version, expires, key, value)
+        finally:
+            self.lock.release()
+        return True
+
+    def evict(self, candidates):
+        """Choose a slot to reuse with the CLOCK algorithm."""
+        hand = SEQ.unpack_from(self.mm, VERSIONS.size)[0]
+        SEQ.pack_into(self.mm, VERSIONS.size, hand + 1)
+        for i in range(2 * len(candidates)):
+            index = candidates[(hand + i) % len(candidates)]
+            ref = self.refs + index
+            if self.mm[ref:ref + 1] == b'\x00':
+                return index
+            self.mm[ref:ref + 1] = b'\x00'
+        return candidates[hand % len(candidates)]
+
+    def write(self, index, h, namespace, version, expires, key, value):
+        offset = self.base + index * self.slot_size
+        seq = SEQ.unpack_from(self.mm, offset)[0]
+        SEQ.pack_into(self.mm, offset, seq + 1)
+        SLOT.pack_into(self.mm, offset, seq + 1, h, version, expires,
+                       namespace, len(key), len(value))
+        start = offset + SLOT.size
+        self.mm[start:start + len(key) + len(value)] = key + value
+        self.mm[self.refs + index:self.refs + index + 1] = b'\x00'
+        SEQ.pack_into(self.mm, offset, seq + 2)
+
+
+def init_app(app):
+    app.config.setdefault('SHARED_CACHE_SLOTS', 4096)
+    app.config.setdefault('SHARED_CACHE_SLOT_SIZE', 2048)
+    app.config.setdefault('SHARED_CACHE_AUTH_TTL', 10)
+    app.config.setdefault('SHARED_CACHE_RESPONSE_TTL', 10)
+    app.extensions['shared_cache'] = SharedCache(
+        app.config['SHARED_CACHE_SLOTS'],
+        app.config['SHARED_CACHE_SLOT_SIZE'])
+
+
+def get_cache():
+    """Return the shared cache of the application, or `None` if it is not
+    enabled."""
+    return current_app.extensions.get('shared_cache')
+
+
+def invalidate_on_commit(session, namespace):
+    """Invalidate `namespace` when the transaction of `session` is
+    committed."""
+    session.info.setdefault('shared_cache_invalidate', set()).add(namespace)
+
+
+# all the changes made through the API flush at least a change log entry,
+# so a commit that follows a flush invalidates the cached responses;
+# changes made by other processes are only seen when the responses expire
+
+@event.listens_for(Session, 'after_flush')
+def after_flush(session, flush_context):
+    invalidate_on_commit(session, RESPONSES)
+
+
+@event.listens_for(Session, 'after_commit')
+def after_commit(session):
+    namespaces = session.info.pop('shared_cache_invalidate', ())
+    if namespaces and has_app_context():
+        cache = get_cache()
+        if cache is not None:
+            for namespace in namespaces:
+                cache.invalidate(namespace)
+
+
+@event.listens_for(Session, 'after_rollback')
+def after_rollback(session):
+    session.info.pop('shared_cache_invalidate', None)
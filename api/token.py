@@ -1,7 +1,9 @@
-from flask import Blueprint, jsonify, g
+from flask import Blueprint, jsonify, g, current_app, abort
 from flask.ext.httpauth import HTTPBasicAuth
-from .models import User
-from .errors import unauthorized
+from .models import User, lookup
+from .auth import auth
+from .errors import unauthorized, bad_request
+from .helpers import count
 from .decorators import no_cache, json
 
 token = Blueprint('token', __name__)
@@ -10,7 +12,7 @@ token_auth = HTTPBasicAuth()
 
 @token_auth.verify_password
 def verify_password(username_or_token, password):
-    g.user = User.query.filter_by(username=username_or_token).first()
+    g.user = lookup(User, username=username_or_token)
     if not g.user:
         return False
     return g.user.verify_password(password)
@@ -18,6 +20,7 @@ def verify_password(username_or_token, password):
 
 @token_auth.error_handler
 def unauthorized_error():
+    count('auth_failures_total')
     return unauthorized('Please authenticate to access this API')
 
 
@@ -27,3 +30,16 @@ def unauthorized_error():
 @json
 def request_token():
     return {'token': g.user.generate_auth_token()}
+
+
+@token.route('/revoke-token', methods=['POST'])
+@no_cache
+@auth.login_required
+def revoke_token():
+    if not current_app.config['USE_TOKEN_REVOCATION']:
+        abort(404)
+    # only the token that authenticated the request can be revoked
+    if getattr(g, 'auth_token', None) is None:
+        return bad_request('the request was not authenticated with a token')
+    User.revoke_auth_token(g.auth_token)
+    return jsonify({})
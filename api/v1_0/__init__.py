@@ -1,7 +1,8 @@
-from flask import Blueprint, g
+from flask import Blueprint, current_app, g
 from ..errors import ValidationError, bad_request, not_found
 from ..auth import auth
-from ..decorators import rate_limit
+from ..decorators import rate_limit, address_scope, user_scope, \
+    endpoint_cost
 
 api = Blueprint('api', __name__)
 
@@ -21,18 +22,38 @@ def not_found_error(e):
     return not_found('item not found')
 
 
+# admission control runs first, so that rejected requests are cheap; its
+# module is only imported when it is enabled
 @api.before_request
-@rate_limit(limit=5, per=15)
+def admit():
+    if 'admission' in current_app.extensions:
+        from .. import admission
+        return admission.admit()
+
+
+@api.teardown_request
+def release(exc=None):
+    if 'admission' in current_app.extensions:
+        from .. import admission
+        admission.release(exc)
+
+
+# requests are limited by address before authentication, so that failed
+# attempts to authenticate are also limited, and then by user
+@api.before_request
+@rate_limit(scope_func=address_scope, limits_config='ADDRESS_RATE_LIMITS')
 @auth.login_required
+@rate_limit(scope_func=user_scope, cost_func=endpoint_cost)
 def before_request():
     pass
 
 
 @api.after_request
 def after_request(response):
-    if hasattr(g, 'headers'):
-        response.headers.extend(g.headers)
+    if getattr(g, 'rate_limit', None) is not None:
+        response.headers.extend(g.rate_limit.headers)
+        g.rate_limit = None
     return response
 
 # do this last to avoid circular dependencies
-from . import students, classes, registrations
+from . import students, classes, registrations, changes
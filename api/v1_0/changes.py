@@ -0,0 +1,35 @@
+import math
+import time
+from flask import request, current_app
+from ..models import db, Change
+from ..errors import ValidationError
+from ..decorators import json, no_cache
+from . import api
+
+
+@api.route('/changes/', methods=['GET'])
+@no_cache
+@json
+def get_changes():
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 100))
+    wait = request.args.get('wait', 0, type=float)
+    if math.isnan(wait) or math.isinf(wait):
+        raise ValidationError('Invalid wait time')
+    wait = max(0.0, min(wait, current_app.config['CHANGES_MAX_WAIT']))
+    deadline = time.time() + wait
+    while True:
+        changes = Change.query.filter(Change.id > since) \
+            .order_by(Change.id).limit(limit + 1).all()
+        if changes or time.time() >= deadline:
+            break
+        # end the transaction, so that the next poll sees new changes
+        db.session.rollback()
+        time.sleep(current_app.config['CHANGES_POLL_INTERVAL'])
+    more = len(changes) > limit
+    changes = changes[:limit]
+    return {
+        'changes': [change.to_json() for change in changes],
+        'cursor': changes[-1].id if changes else since,
+        'more': more
+    }
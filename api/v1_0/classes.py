@@ -1,46 +1,76 @@
 from flask import url_for, request
-from ..models import db, Class
-from ..decorators import json, paginate, etag
+from ..models import db, Class, Change, lookup_or_404
+from .. import sharding
+from ..decorators import json, paginate, etag, last_modified, \
+    idempotent
+from ..search import search
+from ..bulk import bulk_create
 from . import api
 
 
 @api.route('/classes/', methods=['GET'])
+@last_modified()
 @etag
-@paginate()
+@paginate(query_args=('q',))
 def get_classes():
-    return Class.query
+    query = Class.rows()
+    q = request.args.get('q')
+    if q:
+        query = search(Class, query, q)
+    else:
+        query = query.order_by(Class.id)
+    return query
 
 
 @api.route('/classes/<int:id>', methods=['GET'])
+@last_modified(Class.last_modified)
 @etag
 @json
 def get_class(id):
-    return Class.query.get_or_404(id)
+    return lookup_or_404(Class, id=id)
 
 
 @api.route('/classes/<int:id>/registrations/', methods=['GET'])
+@last_modified()
 @etag
 @paginate()
 def get_class_registrations(id):
-    class_ = Class.query.get_or_404(id)
-    return class_.registrations
+    lookup_or_404(Class, id=id)
+    return sharding.registrations(class_id=id)
+
+
+@api.route('/classes/<int:id>/summary', methods=['GET'])
+@last_modified()
+@etag
+@json
+def get_class_summary(id):
+    return lookup_or_404(Class, id=id).summary()
 
 
 @api.route('/classes/', methods=['POST'])
+@idempotent
 @json
 def new_class():
     class_ = Class().from_json(request.json)
     db.session.add(class_)
+    Change.record('create', class_)
     db.session.commit()
     return {}, 201, {'Location': class_.get_url()}
 
 
+@api.route('/classes/bulk', methods=['POST'])
+@json
+def new_classes_bulk():
+    return {'created': bulk_create(Class, request.stream)}, 201
+
+
 @api.route('/classes/<int:id>', methods=['PUT'])
 @json
 def edit_class(id):
-    class_ = Class.query.get_or_404(id)
+    class_ = lookup_or_404(Class, id=id)
     class_.from_json(request.json)
     db.session.add(class_)
+    Change.record('update', class_)
     db.session.commit()
     return {}
 
@@ -48,7 +78,9 @@ def edit_class(id):
 @api.route('/classes/<int:id>', methods=['DELETE'])
 @json
 def delete_class(id):
-    class_ = Class.query.get_or_404(id)
+    class_ = lookup_or_404(Class, id=id)
+    class_.delete_registrations()
     db.session.delete(class_)
+    Change.record('delete', class_)
     db.session.commit()
     return {}
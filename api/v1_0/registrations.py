@@ -1,37 +1,52 @@
 from flask import url_for, request
-from ..models import db, Registration
-from ..decorators import json, paginate, etag
+from ..models import db, Registration, Change
+from .. import sharding
+from ..decorators import json, paginate, etag, last_modified, \
+    idempotent
+from ..bulk import bulk_create
 from . import api
 
 
 @api.route('/registrations/', methods=['GET'])
+@last_modified()
 @etag
 @paginate()
 def get_registrations():
-    return Registration.query
+    return sharding.registrations()
 
 
 @api.route('/registrations/<int:student_id>/<int:class_id>', methods=['GET'])
+@last_modified(Registration.last_modified)
 @etag
 @json
 def get_registration(student_id, class_id):
-    return Registration.query.get_or_404((student_id, class_id))
+    return sharding.get_registration_or_404(student_id, class_id)
 
 
 @api.route('/registrations/', methods=['POST'])
+@idempotent
 @json
 def new_registration():
-    reg = Registration().from_json(request.json)
-    db.session.add(reg)
+    reg = sharding.insert_registration(
+        *Registration.ids_from_json(request.json))
+    reg.update_counts(1)
+    Change.record('create', reg)
     db.session.commit()
     return {}, 201, {'Location': reg.get_url()}
 
 
+@api.route('/registrations/bulk', methods=['POST'])
+@json
+def new_registrations_bulk():
+    return {'created': bulk_create(Registration, request.stream)}, 201
+
+
 @api.route('/registrations/<int:student_id>/<int:class_id>', methods=['DELETE'])
 @json
 def delete_registration(student_id, class_id):
-    reg = Registration.query.get_or_404((student_id, class_id))
-    print(reg.student.id, reg.class_.id)
-    db.session.delete(reg)
+    reg = sharding.get_registration_or_404(student_id, class_id)
+    reg.update_counts(-1)
+    sharding.delete_registration(reg)
+    Change.record('delete', reg)
     db.session.commit()
     return {}
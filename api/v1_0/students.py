@@ -1,46 +1,76 @@
 from flask import request
-from ..models import db, Student
-from ..decorators import json, paginate, etag
+from ..models import db, Student, Change, lookup_or_404
+from .. import sharding
+from ..decorators import json, paginate, etag, last_modified, \
+    idempotent
+from ..search import search
+from ..bulk import bulk_create
 from . import api
 
 
 @api.route('/students/', methods=['GET'])
+@last_modified()
 @etag
-@paginate()
+@paginate(query_args=('q',))
 def get_students():
-    return Student.query
+    query = Student.rows()
+    q = request.args.get('q')
+    if q:
+        query = search(Student, query, q)
+    else:
+        query = query.order_by(Student.id)
+    return query
 
 
 @api.route('/students/<int:id>', methods=['GET'])
+@last_modified(Student.last_modified)
 @etag
 @json
 def get_student(id):
-    return Student.query.get_or_404(id)
+    return lookup_or_404(Student, id=id)
 
 
 @api.route('/students/<int:id>/registrations/', methods=['GET'])
+@last_modified()
 @etag
 @paginate()
 def get_student_registrations(id):
-    student = Student.query.get_or_404(id)
-    return student.registrations
+    lookup_or_404(Student, id=id)
+    return sharding.registrations(student_id=id)
+
+
+@api.route('/students/<int:id>/summary', methods=['GET'])
+@last_modified()
+@etag
+@json
+def get_student_summary(id):
+    return lookup_or_404(Student, id=id).summary()
 
 
 @api.route('/students/', methods=['POST'])
+@idempotent
 @json
 def new_student():
     student = Student().from_json(request.json)
     db.session.add(student)
+    Change.record('create', student)
     db.session.commit()
     return {}, 201, {'Location': student.get_url()}
 
 
+@api.route('/students/bulk', methods=['POST'])
+@json
+def new_students_bulk():
+    return {'created': bulk_create(Student, request.stream)}, 201
+
+
 @api.route('/students/<int:id>', methods=['PUT'])
 @json
 def edit_student(id):
-    student = Student.query.get_or_404(id)
+    student = lookup_or_404(Student, id=id)
     student.from_json(request.json)
     db.session.add(student)
+    Change.record('update', student)
     db.session.commit()
     return {}
 
@@ -48,7 +78,9 @@ def edit_student(id):
 @api.route('/students/<int:id>', methods=['DELETE'])
 @json
 def delete_student(id):
-    student = Student.query.get_or_404(id)
+    student = lookup_or_404(Student, id=id)
+    student.delete_registrations()
     db.session.delete(student)
+    Change.record('delete', student)
     db.session.commit()
     return {}
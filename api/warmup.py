@@ -0,0 +1,90 @@
+import time
+from flask import make_response
+from .models import db, Student, Class, Registration, User, lookup
+
+
+def open_connections(app):
+    engine = db.get_engine(app)
+    connections = [engine.connect()
+                   for i in range(app.config['WARMUP_CONNECTIONS'])]
+    for connection in connections:
+        connection.close()
+
+
+def compile_queries(app):
+    lookup(Student, id=0)
+    lookup(Class, id=0)
+    lookup(Registration, student_id=0, class_id=0)
+    lookup(User, id=0)
+    lookup(User, username='')
+    db.session.remove()
+
+
+def build_urls(app):
+    adapter = app.url_map.bind('localhost')
+    for rule in app.url_map.iter_rules():
+        adapter.build(rule.endpoint, dict((arg, 1) for arg in rule.arguments))
+
+
+def create_serializer(app):
+    if app.config['USE_TOKEN_AUTH']:
+        User.verify_auth_token(User(id=0).generate_auth_token())
+
+
+def preload_responses(app):
+    # the views store their responses in the shared cache under the URL of
+    # the request, and the compressed bodies are stored in the compression
+    # cache
+    compression = app.config['USE_COMPRESSION']
+    if not compression and not app.config['USE_SHARED_CACHE']:
+        return
+    headers = {}
+    if compression:
+        from .compress import compressors, compress_response
+        headers['Accept-Encoding'] = list(compressors)[0]
+    adapter = app.url_map.bind('localhost')
+    for model, endpoint in [(Student, 'api.get_student'),
+                            (Class, 'api.get_class')]:
+        for row in model.rows().limit(app.config['WARMUP_PRELOAD']):
+            with app.test_request_context(
+                    adapter.build(endpoint, {'id': row.id}),
+                    base_url=app.config['WARMUP_BASE_URL'],
+                    headers=headers):
+                rv = make_response(app.view_functions[endpoint](id=row.id))
+                if compression:
+                    compress_response(rv)
+    db.session.remove()
+
+
+phases = [('connections', open_connections),
+          ('queries', compile_queries),
+          ('urls', build_urls),
+          ('serializer', create_serializer),
+          ('preload', preload_responses)]
+
+# the state built by these phases is not inherited by forked processes, so
+# the prefork server runs them again in each worker
+worker_phases = ['connections']
+
+
+def warm_up(app, names=None):
+    """Build the state that is otherwise created lazily by the first
+    requests. When `names` is given only the phases in it are run.
+    Returns a list of (phase, seconds) tuples."""
+    app.config.setdefault('WARMUP_CONNECTIONS', 5)
+    app.config.setdefault('WARMUP_PRELOAD', 0)
+    app.config.setdefault('WARMUP_BASE_URL', None)
+    timings = []
+    with app.app_context():
+        for name, phase in phases:
+            if names is not None and name not in names:
+                continue
+            start = time.time()
+            try:
+                phase(app)
+            except Exception as e:
+                app.logger.warning('Warm-up phase %s failed: %s', name, e)
+            timings.append((name, time.time() - start))
+    for name, seconds in timings:
+        app.logger.info('Warm-up phase %s: %.1fms', name, seconds * 1000)
+    return timings
@@ -0,0 +1,64 @@
+"""Compare deleting a class with many registrations one row at a time
+against the set-based delete.
+
+Usage: python benchmarks/bench_cascade_delete.py [registrations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api.app import create_app
+from api.models import db, Student, Class, Registration
+
+
+def populate(count):
+    db.session.execute(Class.__table__.insert(),
+                       [{'id': 1, 'name': 'algebra',
+                         'registration_count': count}])
+    db.session.execute(Registration.__table__.insert(),
+                       [{'student_id': i + 1, 'class_id': 1}
+                        for i in range(count)])
+    db.session.commit()
+
+
+def delete_rows():
+    # what the ORM cascade did: load each registration and delete it
+    class_ = Class.query.get(1)
+    class_.uncount_registrations()
+    for reg in class_.registrations:
+        db.session.delete(reg)
+    db.session.delete(class_)
+    db.session.commit()
+
+
+def delete_set():
+    class_ = Class.query.get(1)
+    class_.delete_registrations()
+    db.session.delete(class_)
+    db.session.commit()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    app = create_app('test_config')
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Student.__table__.insert(),
+                           [{'id': i + 1, 'name': 'student%d' % i}
+                            for i in range(count)])
+        db.session.commit()
+        for name, delete in [('row by row', delete_rows),
+                             ('set-based', delete_set)]:
+            populate(count)
+            start = time.time()
+            delete()
+            elapsed = time.time() - start
+            assert Registration.query.count() == 0
+            print('%-12s %8.3fs' % (name, elapsed))
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
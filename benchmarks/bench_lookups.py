@@ -0,0 +1,42 @@
+"""Compare cached lookup statements against the ORM query path.
+
+Usage: python benchmarks/bench_lookups.py [lookups]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api.app import create_app
+from api.models import db, Student, User, lookup
+
+
+def run(app, name, count):
+    start = time.time()
+    for i in range(count):
+        db.session.remove()
+        lookup(Student, id=i % 100 + 1)
+        lookup(User, username='user%d' % (i % 100))
+    elapsed = time.time() - start
+    print('%-8s %8.0f lookups/sec' % (name, 2 * count / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    app = create_app('test_config')
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Student.__table__.insert(),
+                           [{'name': 'student%d' % i} for i in range(100)])
+        db.session.execute(User.__table__.insert(),
+                           [{'username': 'user%d' % i} for i in range(100)])
+        db.session.commit()
+        app.config['USE_STATEMENT_CACHE'] = False
+        run(app, 'orm', count)
+        app.config['USE_STATEMENT_CACHE'] = True
+        run(app, 'cached', count)
+
+
+if __name__ == '__main__':
+    main()
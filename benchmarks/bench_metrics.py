@@ -0,0 +1,75 @@
+"""Measure the time the metrics hooks add to each request.
+
+Usage: python benchmarks/bench_metrics.py [requests]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import make_response
+import test_config
+from api.app import create_app
+from api.models import db, Student
+from api import metrics
+
+
+def hooks(app, count):
+    """Time the before and after request hooks on their own."""
+    with app.test_request_context('/api/v1.0/students/1'):
+        response = make_response('{}')
+        start = time.time()
+        for i in range(count):
+            metrics.start_request()
+            metrics.end_request(response)
+        return (time.time() - start) / count
+
+
+def requests(app, count, rounds=5):
+    """Time complete requests, best of several rounds."""
+    with app.app_context():
+        db.create_all()
+        db.session.add(Student(name='susan'))
+        db.session.commit()
+        app.config['USE_TOKEN_AUTH'] = False
+        client = app.test_client()
+        best = None
+        for r in range(rounds):
+            start = time.time()
+            for i in range(count):
+                client.get('/metrics-benchmark')
+            elapsed = (time.time() - start) / count
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+
+def create(use_metrics, directory=None):
+    config = dict((key, getattr(test_config, key))
+                  for key in dir(test_config) if key.isupper())
+    config.update(USE_METRICS=use_metrics, METRICS_DIR=directory)
+    app = create_app(type('Config', (object,), config))
+    app.add_url_rule('/metrics-benchmark', 'benchmark',
+                     lambda: Student.query.get(1).name)
+    return app
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    tmpdir = tempfile.mkdtemp()
+    print('hooks              %6.1fus/request' %
+          (hooks(create(True), count) * 1e6))
+    print('hooks, METRICS_DIR %6.1fus/request' %
+          (hooks(create(True, tmpdir), count) * 1e6))
+    without = requests(create(False), count // 20)
+    with_metrics = requests(create(True, tmpdir), count // 20)
+    print('request, no metrics %6.1fus' % (without * 1e6))
+    print('request, metrics    %6.1fus (%+.1fus)' % (
+        with_metrics * 1e6, (with_metrics - without) * 1e6))
+    shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
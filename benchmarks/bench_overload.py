@@ -0,0 +1,197 @@
+"""Measure goodput under increasing load, with and without admission control.
+
+Requests arrive at a fixed rate regardless of how fast they are answered,
+and a request only counts as good when it succeeds within the client
+deadline. The server is a threaded development server in another process.
+
+Usage: python benchmarks/bench_overload.py [seconds] [deadline]
+"""
+import os
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from base64 import b64encode
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from werkzeug.serving import make_server
+import test_config
+from api.app import create_app
+from api.models import db, Student, User
+
+database = os.path.join(tempfile.mkdtemp(), 'api.sqlite')
+
+
+def factory(use_admission_control):
+    config = dict((key, getattr(test_config, key))
+                  for key in dir(test_config) if key.isupper())
+    config.update(SQLALCHEMY_DATABASE_URI='sqlite:///' + database,
+                  USE_ADMISSION_CONTROL=use_admission_control,
+                  USE_REQUEST_COALESCING=False, USE_METRICS=False)
+    return create_app(type('Config', (object,), config))
+
+
+def serve(use_admission_control):
+    server = make_server('127.0.0.1', 0, factory(use_admission_control),
+                         threaded=True)
+    server.socket.listen(1024)
+    pid = os.fork()
+    if pid == 0:
+        sys.stderr = open(os.devnull, 'w')
+        server.serve_forever()
+        os._exit(0)
+    port = server.server_port
+    server.socket.close()
+    return pid, port
+
+
+def request(auth, i):
+    """Return the raw HTTP request number `i`. One in five requests is a
+    write."""
+    if i % 5 == 0:
+        body = '{"name": "student"}'
+        head = 'POST /api/v1.0/students/ HTTP/1.0\r\n' \
+            'Content-Type: application/json\r\n' \
+            'Content-Length: %d\r\n' % len(body)
+    else:
+        body = ''
+        head = 'GET /api/v1.0/students/%d HTTP/1.0\r\n' % (i % 100 + 1)
+    return (head + 'Authorization: %s\r\n\r\n' % auth + body).encode(
+        'utf-8')
+
+
+def status(response):
+    try:
+        return int(response.split(b' ', 2)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def run(port, auth, rate, seconds, deadline):
+    """Send `rate` requests per second for `seconds` seconds, from a single
+    thread so that the load generator takes little CPU time away from the
+    server. Returns the number of requests per second that succeeded
+    within the deadline, and the percentage of requests rejected with
+    503."""
+    total = int(rate * seconds)
+    start = time.time()
+    sent = 0
+    poll = select.poll()
+    pending = {}  # fd: [socket, request data, response data]
+    started = deque()  # (time, fd, socket) in the order requests were sent
+    statuses = []
+
+    def finish(fd, code):
+        poll.unregister(fd)
+        pending.pop(fd)[0].close()
+        statuses.append(code)
+
+    while sent < total or pending:
+        now = time.time()
+        while sent < total and start + float(sent) / rate <= now:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setblocking(False)
+            s.connect_ex(('127.0.0.1', port))
+            pending[s.fileno()] = [s, request(auth, sent), b'']
+            started.append((now, s.fileno(), s))
+            poll.register(s, select.POLLOUT)
+            sent += 1
+        while started and now - started[0][0] > deadline:
+            t, fd, s = started.popleft()
+            if fd in pending and pending[fd][0] is s:
+                finish(fd, None)
+        timeout = max(0, min(0.01, start + float(sent) / rate - now))
+        for fd, event in poll.poll(timeout * 1000):
+            s, data, response = pending[fd]
+            if data:
+                try:
+                    pending[fd][1] = data[s.send(data):]
+                except socket.error:
+                    finish(fd, None)
+                    continue
+                if not pending[fd][1]:
+                    poll.modify(fd, select.POLLIN)
+                continue
+            try:
+                chunk = s.recv(65536)
+            except socket.error:
+                chunk = b''
+            if chunk:
+                pending[fd][2] += chunk
+            else:
+                finish(fd, status(response))
+    good = len([code for code in statuses
+                if code is not None and code < 300])
+    rejected = len([code for code in statuses if code == 503])
+    return good / float(seconds), 100.0 * rejected / total
+
+
+def capacity(port, auth, seconds):
+    """Measure the throughput with a few clients that send requests one
+    after another."""
+    counts = [0] * 4
+    end = time.time() + seconds
+
+    def client(n):
+        i = n
+        while time.time() < end:
+            s = socket.create_connection(('127.0.0.1', port))
+            s.sendall(request(auth, i))
+            while s.recv(65536):
+                pass
+            s.close()
+            counts[n] += 1
+            i += len(counts)
+
+    threads = [threading.Thread(target=client, args=(n,))
+               for n in range(len(counts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / float(seconds)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    deadline = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    app = factory(False)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Student.__table__.insert(),
+                           [{'name': 'student%d' % i} for i in range(100)])
+        user = User(username='dave', password='cat')
+        db.session.add(user)
+        db.session.commit()
+        token = user.generate_auth_token()
+    auth = 'Basic ' + b64encode((token + ':').encode('utf-8')).decode('utf-8')
+
+    pid, port = serve(False)
+    time.sleep(0.5)
+    max_rate = capacity(port, auth, seconds)
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+    print('capacity %.0f requests/sec, deadline %.1fs' % (max_rate, deadline))
+    print('offered load  goodput (no admission)  goodput (admission)')
+    for load in [0.5, 1, 1.5, 2, 3, 4]:
+        rate = load * max_rate
+        line = '%4.1fx %5.0f/s' % (load, rate)
+        for use_admission_control in [False, True]:
+            pid, port = serve(use_admission_control)
+            time.sleep(0.5)
+            good, rejected = run(port, auth, rate, seconds, deadline)
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+            line += '  %6.0f/s (%3.0f%% 503)' % (good, rejected)
+        print(line)
+    shutil.rmtree(os.path.dirname(database))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Measure the throughput of the prefork server with 1 to N workers.
+
+Usage: python benchmarks/bench_prefork.py [max workers] [seconds]
+"""
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from base64 import b64encode
+try:
+    from http.client import HTTPConnection
+except ImportError:  # pragma: no cover
+    from httplib import HTTPConnection
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api.app import create_app
+from api.models import db, Student, User
+from api.prefork import PreforkServer
+
+database = os.path.join(tempfile.mkdtemp(), 'api.sqlite')
+
+
+def factory():
+    app = create_app('test_config')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database
+    return app
+
+
+def client(port, auth, seconds, results):
+    count = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        connection = HTTPConnection('127.0.0.1', port)
+        connection.request('GET', '/api/v1.0/students/%d' % (count % 100 + 1),
+                           headers={'Authorization': auth})
+        connection.getresponse().read()
+        connection.close()
+        count += 1
+    results.put(count)
+
+
+def run(workers, clients, auth, seconds):
+    server = PreforkServer(factory, port=0, workers=workers,
+                           access_log=False)
+    pid = os.fork()
+    if pid == 0:
+        sys.stderr = open(os.devnull, 'w')
+        server.run()
+        os._exit(0)
+    server.server.server_close()
+    time.sleep(1)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+        target=client, args=(server.address[1], auth, seconds, results))
+        for i in range(clients)]
+    for process in processes:
+        process.start()
+    total = sum(results.get() for process in processes)
+    for process in processes:
+        process.join()
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+    print('%2d workers %8.0f requests/sec' % (workers, total / seconds))
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 \
+        else multiprocessing.cpu_count()
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    app = factory()
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Student.__table__.insert(),
+                           [{'name': 'student%d' % i} for i in range(100)])
+        user = User(username='dave', password='cat')
+        db.session.add(user)
+        db.session.commit()
+        token = user.generate_auth_token()
+    auth = 'Basic ' + b64encode((token + ':').encode('utf-8')).decode('utf-8')
+    workers = 1
+    while True:
+        run(workers, 2 * max_workers, auth, seconds)
+        if workers == max_workers:
+            break
+        workers = min(workers * 2, max_workers)
+    shutil.rmtree(os.path.dirname(database))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compare ORM instances against lightweight row objects for list endpoints.
+
+Usage: python benchmarks/bench_read_models.py [registrations] [page_size]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api.app import create_app
+from api.models import db, Student, Class, Registration
+
+
+def populate(count):
+    students = int(count ** 0.5) + 1
+    db.session.execute(Student.__table__.insert(),
+                       [{'id': i, 'name': 'student%d' % i}
+                        for i in range(1, students + 1)])
+    db.session.execute(Class.__table__.insert(),
+                       [{'id': i, 'name': 'class%d' % i}
+                        for i in range(1, students + 1)])
+    db.session.execute(Registration.__table__.insert(),
+                       [{'student_id': i // students + 1,
+                         'class_id': i % students + 1}
+                        for i in range(count)])
+    db.session.commit()
+
+
+def run(name, load, page_size, rounds=20):
+    db.session.remove()
+    tracemalloc.start()
+    urls = [item.get_url() for item in load(page_size)]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert len(urls) == page_size
+    start = time.time()
+    for i in range(rounds):
+        db.session.remove()
+        [item.get_url() for item in load(page_size)]
+    elapsed = time.time() - start
+    print('%-4s %8.0f items/sec  peak memory %8.1f KiB' % (
+        name, rounds * page_size / elapsed, peak / 1024.0))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    app = create_app('test_config')
+    with app.test_request_context():
+        db.create_all()
+        populate(count)
+        run('orm', lambda n: Registration.query.paginate(1, n).items,
+            page_size)
+        run('rows', lambda n: Registration.rows().paginate(1, n).items,
+            page_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compare full-text search against LIKE scans on student names.
+
+Usage: python benchmarks/bench_search.py [students]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from api.app import create_app
+from api.models import db, Student
+from api import search
+
+
+def random_word(rnd):
+    return ''.join(rnd.choice('bcdfghjklmnprstvz') + rnd.choice('aeiou')
+                   for i in range(rnd.randint(2, 4)))
+
+
+def populate(count):
+    rnd = random.Random(42)
+    words = [random_word(rnd) for i in range(5000)]
+    insert = Student.__table__.insert()
+    for start in range(0, count, 50000):
+        db.session.execute(insert, [
+            {'name': rnd.choice(words) + ' ' + rnd.choice(words)}
+            for i in range(start, min(count, start + 50000))])
+    db.session.commit()
+    return words
+
+
+def run(name, queries):
+    start = time.time()
+    total = 0
+    for q in queries:
+        p = search.search(Student, Student.rows(), q).paginate(1, 10)
+        total += p.total
+    elapsed = time.time() - start
+    print('%-5s %8.2fms/query  %d matches' % (
+        name, elapsed * 1000 / len(queries), total))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    try:
+        app = create_app('test_config')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+        with app.test_request_context():
+            db.create_all()
+            words = populate(count)
+            rnd = random.Random(1)
+            queries = [rnd.choice(words)[:4] for i in range(20)]
+            search.fts5_available()
+            run('fts5', queries)
+            search.search_state()['fts5'][db.engine] = False
+            run('like', queries)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
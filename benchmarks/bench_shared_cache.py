@@ -0,0 +1,158 @@
+"""Compare the shared memory cache with per-process caches and with Redis.
+
+Measures the time of a cache hit, the hit rate when several worker
+processes share the same traffic, and the time of authenticated requests
+for a student with and without the shared cache. Redis is skipped if there
+is no server on localhost.
+
+Usage: python benchmarks/bench_shared_cache.py [workers] [requests]
+"""
+import bisect
+import os
+import random
+import sys
+import time
+from base64 import b64encode
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import test_config
+from api.app import create_app
+from api.compress import CompressionCache
+from api.models import db, Student, User
+from api.shared_cache import SharedCache, RESPONSES
+
+value = b'x' * 300
+
+
+def time_hits(get, count=100000):
+    start = time.time()
+    for i in range(count):
+        get(b'key%d' % (i % 100))
+    return (time.time() - start) / count
+
+
+def hit_latency():
+    local = CompressionCache(1024)
+    shared = SharedCache(1024, 512)
+    for i in range(100):
+        local.set(b'key%d' % i, value)
+        shared.set(RESPONSES, b'key%d' % i, value)
+    print('hit latency')
+    print('  per-process dict %6.2fus' % (time_hits(local.get) * 1e6))
+    print('  shared memory    %6.2fus' % (
+        time_hits(lambda key: shared.get(RESPONSES, key)) * 1e6))
+    try:
+        from redis import Redis
+        redis = Redis()
+        for i in range(100):
+            redis.set(b'key%d' % i, value)
+        print('  local redis      %6.2fus' % (
+            time_hits(redis.get, 10000) * 1e6))
+    except Exception as e:
+        print('  local redis      not available (%s)' % e.__class__.__name__)
+
+
+def keys(count, seed, population=10000, s=0.9):
+    """Generate keys with a Zipf distribution, like the requests for the
+    students and classes of a busy service."""
+    weights = [1.0 / (k ** s) for k in range(1, population + 1)]
+    cumulative = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    rng = random.Random(seed)
+    return [b'key%d' % bisect.bisect(cumulative, rng.random() * total)
+            for i in range(count)]
+
+
+def worker(get, set, requests, seed, max_requests, reset):
+    hits = 0
+    for i, key in enumerate(keys(requests, seed)):
+        if i and i % max_requests == 0:
+            reset()
+        if get(key) is not None:
+            hits += 1
+        else:
+            set(key, value)
+    return hits
+
+
+def hit_rate(workers, requests, capacity, max_requests):
+    """Run `workers` processes that cache `capacity` entries each in their
+    own dictionary, or `workers * capacity` entries in total in the shared
+    segment, so both use the same memory. Each worker is replaced by a new
+    one every `max_requests` requests."""
+    print('hit rate, %d workers recycled every %d requests, %d MB' % (
+        workers, max_requests, workers * capacity * 512 // (1024 * 1024)))
+    for name in ['per-process dict', 'shared memory']:
+        shared = SharedCache(workers * capacity, 512)
+        pids = []
+        read, write = os.pipe()
+        for n in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                if name == 'shared memory':
+                    hits = worker(lambda key: shared.get(RESPONSES, key),
+                                  lambda key, value: shared.set(
+                                      RESPONSES, key, value),
+                                  requests, n, max_requests, lambda: None)
+                else:
+                    local = [CompressionCache(capacity)]
+
+                    def reset():
+                        local[0] = CompressionCache(capacity)
+
+                    hits = worker(lambda key: local[0].get(key),
+                                  lambda key, value: local[0].set(key, value),
+                                  requests, n, max_requests, reset)
+                os.write(write, ('%d\n' % hits).encode('utf-8'))
+                os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        os.close(write)
+        with os.fdopen(read) as f:
+            hits = sum(int(line) for line in f)
+        print('  %-16s %5.1f%%' % (name, 100.0 * hits / (workers * requests)))
+
+
+def request_time(use_shared_cache, count):
+    config = dict((key, getattr(test_config, key))
+                  for key in dir(test_config) if key.isupper())
+    config.update(USE_SHARED_CACHE=use_shared_cache, USE_METRICS=False,
+                  USE_ADMISSION_CONTROL=False)
+    app = create_app(type('Config', (object,), config))
+    with app.app_context():
+        db.create_all()
+        db.session.add(Student(name='susan'))
+        user = User(username='dave', password='cat')
+        db.session.add(user)
+        db.session.commit()
+        headers = {'Authorization': 'Basic ' + b64encode(
+            (user.generate_auth_token() + ':').encode('utf-8')).decode(
+                'utf-8')}
+        client = app.test_client()
+        client.get('/api/v1.0/students/1', headers=headers)
+        start = time.time()
+        for i in range(count):
+            client.get('/api/v1.0/students/1', headers=headers)
+        return (time.time() - start) / count
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    hit_latency()
+    hit_rate(workers, requests, 1024, requests)
+    hit_rate(workers, requests, 1024, 1000)
+    without = request_time(False, 2000)
+    with_cache = request_time(True, 2000)
+    print('GET /students/1 with token auth')
+    print('  no shared cache  %6.0fus' % (without * 1e6))
+    print('  shared cache     %6.0fus' % (with_cache * 1e6))
+
+
+if __name__ == '__main__':
+    main()
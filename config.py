@@ -2,3 +2,16 @@ SECRET_KEY = 'secret'
 SQLALCHEMY_DATABASE_URI = 'sqlite:///api.sqlite'
 USE_TOKEN_AUTH = False
 USE_RATE_LIMITS = False
+USE_COMPRESSION = True
+USE_STATEMENT_CACHE = True
+USE_TOKEN_REVOCATION = False
+WARMUP_ON_STARTUP = False
+USE_METRICS = True
+USE_REQUEST_COALESCING = True
+USE_IDEMPOTENCY_KEYS = False
+USE_ADMISSION_CONTROL = True
+USE_SHARED_CACHE = True
+RATE_LIMITS = [(5, 15), (1000, 3600)]
+ADDRESS_RATE_LIMITS = [(50, 15)]
+RATE_LIMIT_COSTS = {'api.get_students': 2, 'api.get_classes': 2,
+                    'api.get_registrations': 2}
@@ -1,24 +1,29 @@
 #!/usr/bin/env python
-from flask import Flask, g, jsonify
-from flask.ext.script import Manager
-from api.app import create_app
-from api.models import db, User
+from flask import current_app
+from flask.ext.script import Manager, Command, Option
+
+
+def create_app():
+    # the application is imported when a command runs, not to parse the
+    # command line; commands run with the application created here
+    from api.app import create_app
+    return create_app()
 
 manager = Manager(create_app)
 
 
 @manager.command
 def createdb():
-    app = create_app()
-    with app.app_context():
-        db.drop_all()
-        db.create_all()
+    from api.models import db
+    db.drop_all()
+    db.create_all()
 
 
 @manager.command
 def adduser(username):
     """Register a new user."""
     from getpass import getpass
+    from api.models import db, User
     password = getpass()
     password2 = getpass(prompt='Confirm: ')
     if password != password2:
@@ -31,6 +36,55 @@ def adduser(username):
     print('User {0} was registered successfully.'.format(username))
 
 
+@manager.option('-p', '--preload', dest='preload', type=int, default=0,
+                help='Number of students and classes to preload')
+def warmup(preload):
+    """Run the startup warm-up and report the time spent in each phase."""
+    from api.warmup import warm_up
+    app = current_app._get_current_object()
+    app.config['WARMUP_PRELOAD'] = preload
+    for name, seconds in warm_up(app):
+        print('{0:<12} {1:8.1f}ms'.format(name, seconds * 1000))
+
+
+@manager.option('-H', '--host', dest='host', default='127.0.0.1')
+@manager.option('-p', '--port', dest='port', type=int, default=5000)
+@manager.option('-w', '--workers', dest='workers', type=int, default=0,
+                help='Number of worker processes (default: one per CPU)')
+@manager.option('--max-requests', dest='max_requests', type=int, default=0,
+                help='Restart each worker after this many requests')
+def serve(host, port, workers, max_requests):
+    """Run the application on a prefork server."""
+    from api.app import create_app
+    from api.prefork import PreforkServer
+    PreforkServer(create_app, host=host, port=port, workers=workers,
+                  max_requests=max_requests).run()
+
+
+class ImportCommand(Command):
+    """Bulk import students, classes and registrations from CSV or NDJSON
+    files."""
+    option_list = (
+        Option('-s', '--students', dest='students'),
+        Option('-c', '--classes', dest='classes'),
+        Option('-r', '--registrations', dest='registrations'),
+        Option('--chunk-size', dest='chunk_size', type=int, default=10000),
+        Option('--rebuild-indexes', dest='rebuild_indexes',
+               action='store_true', default=False),
+    )
+
+    def run(self, chunk_size, rebuild_indexes, **files):
+        from api.importer import bulk_import
+        files = dict((name, path) for name, path in files.items() if path)
+        stats = bulk_import(files, chunk_size=chunk_size,
+                            rebuild_indexes=rebuild_indexes)
+        for name, rows, seconds in stats:
+            print('{0:<14} {1:>10} rows {2:8.2f}s {3:>10.0f} rows/sec'.format(
+                name, rows, seconds, rows / seconds if seconds else 0))
+
+manager.add_command('import', ImportCommand())
+
+
 @manager.command
 def test():
     from subprocess import call
@@ -3,3 +3,12 @@ SECRET_KEY = 'secret'
 SQLALCHEMY_DATABASE_URI = 'sqlite://'
 USE_TOKEN_AUTH = True
 USE_RATE_LIMITS = False
+USE_COMPRESSION = False
+USE_STATEMENT_CACHE = True
+USE_TOKEN_REVOCATION = True
+WARMUP_ON_STARTUP = False
+USE_METRICS = True
+USE_REQUEST_COALESCING = True
+USE_IDEMPOTENCY_KEYS = True
+USE_ADMISSION_CONTROL = True
+USE_SHARED_CACHE = True
@@ -1,9 +1,28 @@
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
 import unittest
+from datetime import datetime, timedelta
+from flask import g
 from werkzeug.exceptions import BadRequest
 from .test_client import TestClient
 from api.app import create_app
-from api.models import db, User
+from sqlalchemy import event
+from api.models import db, User, UserRow, Student, Registration, Change, \
+    compiled_cache
 from api.errors import ValidationError
+from api.warmup import warm_up, worker_phases
+from api.importer import bulk_import
+from api import compress, search
+from api.metrics import Metrics
+from api.decorators import etag
+from api.idempotency import storage_key
+from api.redis_client import get_redis
+from api.admission import AdmissionController, HIGH, LOW
+from api.shared_cache import SharedCache, AUTH, RESPONSES
 
 
 class TestAPI(unittest.TestCase):
@@ -328,8 +347,47 @@ class TestAPI(unittest.TestCase):
         self.assertTrue(int(rv.headers['X-RateLimit-Limit']) == int(rv.headers['X-RateLimit-Remaining']) + 1)
         while int(rv.headers['X-RateLimit-Remaining']) > 0:
             rv, json = self.client.get('/api/v1.0/registrations/')
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.get('/api/v1.0/registrations/')
         self.assertTrue(rv.status_code == 429)
 
+        # failed authentication attempts are limited by address
+        self.app.config['ADDRESS_RATE_LIMITS'] = [(3, 20)]
+        bad_client = TestClient(self.app, 'bad_token', '')
+        for i in range(3):
+            rv, json = bad_client.get('/api/v1.0/students/')
+            self.assertTrue(rv.status_code == 401)
+        rv, json = bad_client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 429)
+
+    def test_rate_limit_tiers(self):
+        self.app.config['USE_RATE_LIMITS'] = True
+        self.app.config['RATE_LIMITS'] = [(3, 20), (100, 3600)]
+        self.app.config['RATE_LIMIT_COSTS'] = {'api.get_students': 2}
+
+        # headers describe the tier with fewest remaining requests
+        rv, json = self.client.get('/api/v1.0/registrations/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(rv.headers['X-RateLimit-Limit'] == '3')
+        self.assertTrue(rv.headers['X-RateLimit-Remaining'] == '2')
+
+        # list of students costs two requests, which use up the limit
+        rv, json = self.client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(rv.headers['X-RateLimit-Remaining'] == '0')
+        rv, json = self.client.get('/api/v1.0/registrations/')
+        self.assertTrue(rv.status_code == 429)
+        self.assertTrue(rv.headers['X-RateLimit-Remaining'] == '0')
+
+        # limits are tracked separately for each user
+        u = User(username='susan', password='dog')
+        db.session.add(u)
+        db.session.commit()
+        client = TestClient(self.app, u.generate_auth_token(), '')
+        rv, json = client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(rv.headers['X-RateLimit-Remaining'] == '1')
+
     def test_pagination(self):
         # create several students
         rv, json = self.client.post('/api/v1.0/students/',
@@ -457,3 +515,1097 @@ class TestAPI(unittest.TestCase):
         rv, json = self.client.get(one_url, headers={
             'If-None-Match': one_etag})
         self.assertTrue(rv.status_code == 200)
+
+    def test_compression(self):
+        self.app.config['USE_COMPRESSION'] = True
+        compress.init_app(self.app)
+        self.app.config['COMPRESSION_MIN_SIZE'] = 0
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'one'})
+        self.assertTrue(rv.status_code == 201)
+        one_url = rv.headers['Location']
+
+        # uncompressed response
+        rv, json = self.client.get(one_url)
+        self.assertTrue(rv.status_code == 200)
+        self.assertFalse('Content-Encoding' in rv.headers)
+        self.assertTrue('Accept-Encoding' in rv.headers['Vary'])
+        etag = rv.headers['ETag']
+
+        # compressed response
+        rv, json = self.client.get(one_url, headers={
+            'Accept-Encoding': 'gzip'})
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(rv.headers['Content-Encoding'] == 'gzip')
+        self.assertTrue('Accept-Encoding' in rv.headers['Vary'])
+        self.assertTrue(json['name'] == 'one')
+        gzip_etag = rv.headers['ETag']
+        self.assertTrue(gzip_etag == etag[:-1] + '-gzip"')
+        gzip_data = rv.data
+
+        # repeated request is served from the compression cache
+        cache = self.app.extensions['compression']
+        self.assertTrue(len(cache.entries) == 1)
+        rv, json = self.client.get(one_url, headers={
+            'Accept-Encoding': 'gzip'})
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(rv.data == gzip_data)
+        self.assertTrue(len(cache.entries) == 1)
+
+        # both entity tag variants validate
+        rv, json = self.client.get(one_url, headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag})
+        self.assertTrue(rv.status_code == 304)
+        rv, json = self.client.get(one_url, headers={
+            'If-None-Match': gzip_etag})
+        self.assertTrue(rv.status_code == 304)
+
+        # small responses are not compressed
+        self.app.config['COMPRESSION_MIN_SIZE'] = 10000
+        rv, json = self.client.get(one_url, headers={
+            'Accept-Encoding': 'gzip'})
+        self.assertTrue(rv.status_code == 200)
+        self.assertFalse('Content-Encoding' in rv.headers)
+
+    def test_statement_cache(self):
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'one'})
+        self.assertTrue(rv.status_code == 201)
+        one_url = rv.headers['Location']
+
+        # lookups compile once and then reuse the compiled statement
+        rv, json = self.client.get(one_url)
+        self.assertTrue(rv.status_code == 200)
+        cached = len(compiled_cache)
+        self.assertTrue(cached > 0)
+        rv, json = self.client.get(one_url)
+        self.assertTrue(rv.status_code == 200)
+        rv, json2 = self.client.get(one_url + '0')
+        self.assertTrue(rv.status_code == 404)
+        self.assertTrue(len(compiled_cache) == cached)
+
+        # the uncached path returns the same results
+        self.app.config['USE_STATEMENT_CACHE'] = False
+        rv, json2 = self.client.get(one_url)
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json == json2)
+        rv, json = self.client.get(one_url + '0')
+        self.assertTrue(rv.status_code == 404)
+
+    def test_revoke_token(self):
+        u = User.query.get(1)
+        token = u.generate_auth_token()
+        other_token = u.generate_auth_token()
+        client = TestClient(self.app, token, '')
+        other_client = TestClient(self.app, other_token, '')
+        rv, json = client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+
+        # revoke the token
+        rv, json = client.post('/auth/revoke-token', data={})
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue('no-cache' in rv.headers['Cache-Control'])
+
+        # the revoked token is rejected, other tokens are not affected
+        rv, json = client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 401)
+        rv, json = other_client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+
+        # the revocation is visible after the denylist is synced
+        revoked = self.app.extensions['token_revocation']
+        revoked.sync()
+        rv, json = client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 401)
+        rv, json = other_client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+
+        # requests authenticated with a password have no token to revoke
+        self.app.config['USE_TOKEN_AUTH'] = False
+        password_client = TestClient(self.app, self.default_username,
+                                     self.default_password)
+        rv, json = password_client.post('/auth/revoke-token', data={})
+        self.assertTrue(rv.status_code == 400)
+        rv, json = other_client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 401)
+        self.app.config['USE_TOKEN_AUTH'] = True
+        rv, json = other_client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+
+    def test_warmup(self):
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'one'})
+        self.assertTrue(rv.status_code == 201)
+
+        # without compression the responses are preloaded in the shared cache
+        self.app.config['WARMUP_PRELOAD'] = 10
+        warm_up(self.app)
+        self.assertTrue(self.app.extensions['shared_cache'].get(
+            RESPONSES, rv.headers['Location'].encode('utf-8')) is not None)
+
+        # the workers of the prefork server only open their connections
+        timings = warm_up(self.app, worker_phases)
+        self.assertTrue([t[0] for t in timings] == ['connections'])
+
+        self.app.config['USE_COMPRESSION'] = True
+        compress.init_app(self.app)
+        self.app.config['COMPRESSION_MIN_SIZE'] = 0
+        self.app.config['WARMUP_PRELOAD'] = 10
+        timings = warm_up(self.app)
+        self.assertTrue([t[0] for t in timings] == [
+            'connections', 'queries', 'urls', 'serializer', 'preload'])
+
+        # the preloaded response is in the compression cache
+        cache = self.app.extensions['compression']
+        self.assertTrue(len(cache.entries) == 1)
+
+    def test_bulk_import(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            files = {'students': os.path.join(tmpdir, 'students.csv'),
+                     'classes': os.path.join(tmpdir, 'classes.ndjson'),
+                     'registrations': os.path.join(tmpdir,
+                                                   'registrations.csv')}
+            with open(files['students'], 'w') as f:
+                f.write('id,name\n')
+                for i in range(1, 26):
+                    f.write('%d,student%d\n' % (i, i))
+            with open(files['classes'], 'w') as f:
+                for i in range(1, 6):
+                    f.write('{"id": %d, "name": "class%d"}\n' % (i, i))
+            with open(files['registrations'], 'w') as f:
+                f.write('student_id,class_id,timestamp\n')
+                for i in range(1, 26):
+                    f.write('%d,%d,2014-04-10 10:00:00\n' % (i, i % 5 + 1))
+            stats = bulk_import(files, chunk_size=10, rebuild_indexes=True)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertTrue([(s[0], s[1]) for s in stats] == [
+            ('students', 25), ('classes', 5), ('registrations', 25)])
+
+        rv, json = self.client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['meta']['total'] == 25)
+        rv, json = self.client.get('/api/v1.0/classes/5')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['name'] == 'class5')
+        rv, json = self.client.get('/api/v1.0/registrations/4/5')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue('2014' in json['timestamp'])
+        rv, json = self.client.get('/api/v1.0/classes/5/summary')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['registration_count'] == 5)
+
+        # the import is in the change feed, once per table
+        rv, json = self.client.get('/api/v1.0/changes/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue([(c['action'], c['url']) for c in json['changes']] ==
+                        [('import', 'http://localhost/api/v1.0/students/'),
+                         ('import', 'http://localhost/api/v1.0/classes/'),
+                         ('import',
+                          'http://localhost/api/v1.0/registrations/')])
+
+        # empty values take the default of their column
+        tmpdir = tempfile.mkdtemp()
+        try:
+            files = {'students': os.path.join(tmpdir, 'students.csv'),
+                     'classes': os.path.join(tmpdir, 'classes.ndjson')}
+            with open(files['students'], 'w') as f:
+                f.write('id,name,registration_count\n26,a,\n27,,\n28,c,0\n')
+            with open(files['classes'], 'w') as f:
+                f.write('{"name": "class6"}\n{"id": 7, "name": ""}\n'
+                        '{"id": 8, "name": "class8"}\n')
+            stats = bulk_import(files, chunk_size=10)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertTrue([(s[0], s[1]) for s in stats] == [
+            ('students', 3), ('classes', 3)])
+        rv, json = self.client.get('/api/v1.0/students/27')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['name'] is None)
+        rv, json = self.client.get('/api/v1.0/students/26/summary')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['registration_count'] == 0)
+        rv, json = self.client.get('/api/v1.0/classes/6')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['name'] == 'class6')
+
+    def test_summaries(self):
+        students = []
+        for name in ['susan', 'david']:
+            rv, json = self.client.post('/api/v1.0/students/',
+                                        data={'name': name})
+            self.assertTrue(rv.status_code == 201)
+            students.append(rv.headers['Location'])
+        classes = []
+        for name in ['algebra', 'lit']:
+            rv, json = self.client.post('/api/v1.0/classes/',
+                                        data={'name': name})
+            self.assertTrue(rv.status_code == 201)
+            classes.append(rv.headers['Location'])
+        for student, class_ in [(0, 0), (0, 1), (1, 0)]:
+            rv, json = self.client.post('/api/v1.0/registrations/',
+                                        data={'student': students[student],
+                                              'class': classes[class_]})
+            self.assertTrue(rv.status_code == 201)
+            reg_url = rv.headers['Location']
+
+        # get summaries
+        rv, json = self.client.get(students[0])
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.get(json['summary'])
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['student'] == students[0])
+        self.assertTrue(json['registration_count'] == 2)
+        self.assertTrue(json['class_ids'] == [1, 2])
+        rv, json = self.client.get(classes[0])
+        self.assertTrue(rv.status_code == 200)
+        algebra_summary_url = json['summary']
+        rv, json = self.client.get(algebra_summary_url)
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['class'] == classes[0])
+        self.assertTrue(json['registration_count'] == 2)
+        self.assertTrue(json['student_ids'] == [1, 2])
+
+        # summaries are updated when registrations are removed
+        rv, json = self.client.delete(reg_url)
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.get(algebra_summary_url)
+        self.assertTrue(json['registration_count'] == 1)
+        self.assertTrue(json['student_ids'] == [1])
+        rv, json = self.client.delete(students[0])
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.get(algebra_summary_url)
+        self.assertTrue(json['registration_count'] == 0)
+        self.assertTrue(json['student_ids'] == [])
+        rv, json = self.client.get(
+            algebra_summary_url.replace('classes/1', 'classes/2'))
+        self.assertTrue(json['registration_count'] == 0)
+        rv, json = self.client.get(
+            algebra_summary_url.replace('classes/1', 'students/2'))
+        self.assertTrue(json['registration_count'] == 0)
+
+    def test_search(self):
+        urls = {}
+        for name in ['susan smith', 'david jones', 'susanna', 'john']:
+            rv, json = self.client.post('/api/v1.0/students/',
+                                        data={'name': name})
+            self.assertTrue(rv.status_code == 201)
+            urls[name] = rv.headers['Location']
+        rv, json = self.client.post('/api/v1.0/classes/',
+                                    data={'name': 'algebra'})
+        self.assertTrue(rv.status_code == 201)
+        algebra_url = rv.headers['Location']
+
+        # prefix search
+        rv, json = self.client.get('/api/v1.0/students/?q=sus')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(sorted(json['urls']) == sorted(
+            [urls['susan smith'], urls['susanna']]))
+        rv, json = self.client.get('/api/v1.0/students/?q=smi+sus')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['urls'] == [urls['susan smith']])
+        rv, json = self.client.get('/api/v1.0/students/?q=xyz')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['urls'] == [])
+        rv, json = self.client.get('/api/v1.0/classes/?q=alg')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['urls'] == [algebra_url])
+
+        # pagination links keep the search
+        rv, json = self.client.get('/api/v1.0/students/?q=sus&per_page=1')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(len(json['urls']) == 1)
+        self.assertTrue(json['meta']['total'] == 2)
+        self.assertTrue('q=sus' in json['meta']['next'])
+
+        # other arguments are not passed to the links
+        for args in ['_external=0', 'endpoint=x', '_method=POST',
+                     '_scheme=ftp', '_anchor=x']:
+            rv, json = self.client.get(
+                '/api/v1.0/students/?q=sus&per_page=1&' + args)
+            self.assertTrue(rv.status_code == 200)
+            url = json['meta']['next']
+            self.assertTrue(url.startswith(
+                'http://localhost/api/v1.0/students/?'))
+            self.assertTrue('q=sus' in url)
+            self.assertTrue(args.split('=')[0] not in url)
+            self.assertTrue('#' not in url)
+
+        # the index follows changes
+        rv, json = self.client.put(urls['john'], data={'name': 'susie'})
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.delete(urls['susanna'])
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.get('/api/v1.0/students/?q=sus')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(sorted(json['urls']) == sorted(
+            [urls['susan smith'], urls['john']]))
+
+        # substring search when full-text search is not available, or when
+        # the index does not exist
+        state = search.search_state()
+        fts5 = state['fts5'][db.engine]
+        state['fts5'][db.engine] = False
+        try:
+            rv, json = self.client.get('/api/v1.0/students/?q=ones')
+            self.assertTrue(rv.status_code == 200)
+            self.assertTrue(json['urls'] == [urls['david jones']])
+        finally:
+            state['fts5'][db.engine] = fts5
+        if fts5:
+            db.session.execute('DROP TABLE students_fts')
+            db.session.commit()
+            state['indexes'].clear()
+            rv, json = self.client.get('/api/v1.0/students/?q=avid')
+            self.assertTrue(rv.status_code == 200)
+            self.assertTrue(json['urls'] == [urls['david jones']])
+
+        # the state is kept for each application
+        other = create_app('test_config')
+        self.assertTrue(search.search_state(other) is not state)
+
+    def test_changes(self):
+        # start with an empty log
+        rv, json = self.client.get('/api/v1.0/changes/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['changes'] == [])
+        self.assertTrue(json['cursor'] == 0)
+
+        # make some changes
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'susan'})
+        self.assertTrue(rv.status_code == 201)
+        susan_url = rv.headers['Location']
+        rv, json = self.client.post('/api/v1.0/classes/',
+                                    data={'name': 'algebra'})
+        self.assertTrue(rv.status_code == 201)
+        algebra_url = rv.headers['Location']
+        rv, json = self.client.post('/api/v1.0/registrations/',
+                                    data={'student': susan_url,
+                                          'class': algebra_url})
+        self.assertTrue(rv.status_code == 201)
+        reg_url = rv.headers['Location']
+        rv, json = self.client.put(susan_url, data={'name': 'susan2'})
+        self.assertTrue(rv.status_code == 200)
+
+        # wait times must be finite
+        for wait in ['nan', 'inf', '-inf']:
+            with self.assertRaises(ValidationError):
+                self.client.get('/api/v1.0/changes/?wait=' + wait)
+
+        # limits below one return a single change
+        for limit in [0, -1]:
+            rv, json = self.client.get('/api/v1.0/changes/?since=0&limit=%d'
+                                       % limit)
+            self.assertTrue(rv.status_code == 200)
+            self.assertTrue(len(json['changes']) == 1)
+            self.assertTrue(json['more'])
+
+        rv, json = self.client.get('/api/v1.0/changes/?since=0&limit=3')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue([(c['action'], c['url']) for c in json['changes']] ==
+                        [('create', susan_url), ('create', algebra_url),
+                         ('create', reg_url)])
+        self.assertTrue(json['more'])
+        rv, json = self.client.get('/api/v1.0/changes/?since=%d' %
+                                   json['cursor'])
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue([(c['action'], c['resource'])
+                         for c in json['changes']] == [('update', 'student')])
+        self.assertFalse(json['more'])
+        cursor = json['cursor']
+
+        # wait for changes that do not come
+        rv, json = self.client.get('/api/v1.0/changes/?since=%d&wait=0.1' %
+                                   cursor)
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['changes'] == [])
+        self.assertTrue(json['cursor'] == cursor)
+
+        # deletions
+        rv, json = self.client.delete(reg_url)
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.delete(algebra_url)
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.get('/api/v1.0/changes/?since=%d' % cursor)
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue([(c['action'], c['url']) for c in json['changes']] ==
+                        [('delete', reg_url), ('delete', algebra_url)])
+
+    def test_last_modified(self):
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'one'})
+        self.assertTrue(rv.status_code == 201)
+        one_url = rv.headers['Location']
+
+        # date the student and the change log in the past
+        db.session.execute(Student.__table__.update().values(
+            updated_at=datetime(2014, 4, 10, 10, 0, 0, 500000)))
+        db.session.execute(Change.__table__.update().values(
+            timestamp=datetime(2014, 4, 10, 11, 0, 0)))
+        db.session.commit()
+
+        rv, json = self.client.get(one_url)
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(rv.headers['Last-Modified'] ==
+                        'Thu, 10 Apr 2014 10:00:00 GMT')
+        etag = rv.headers['ETag']
+        rv, json = self.client.get(one_url, headers={
+            'If-Modified-Since': 'Thu, 10 Apr 2014 10:00:00 GMT'})
+        self.assertTrue(rv.status_code == 304)
+        self.assertTrue(rv.headers['Last-Modified'] ==
+                        'Thu, 10 Apr 2014 10:00:00 GMT')
+        rv, json = self.client.get(one_url, headers={
+            'If-Modified-Since': 'Thu, 10 Apr 2014 09:59:59 GMT'})
+        self.assertTrue(rv.status_code == 200)
+
+        # If-None-Match takes precedence
+        rv, json = self.client.get(one_url, headers={
+            'If-Modified-Since': 'Thu, 10 Apr 2014 10:00:00 GMT',
+            'If-None-Match': '"other"'})
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.get(one_url, headers={
+            'If-Modified-Since': 'Thu, 10 Apr 2014 09:00:00 GMT',
+            'If-None-Match': etag})
+        self.assertTrue(rv.status_code == 304)
+
+        # collections are dated by the last change
+        rv, json = self.client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(rv.headers['Last-Modified'] ==
+                        'Thu, 10 Apr 2014 11:00:00 GMT')
+        rv, json = self.client.get('/api/v1.0/students/', headers={
+            'If-Modified-Since': 'Thu, 10 Apr 2014 11:00:00 GMT'})
+        self.assertTrue(rv.status_code == 304)
+
+        # changes make the resources newer
+        rv, json = self.client.put(one_url, data={'name': 'two'})
+        self.assertTrue(rv.status_code == 200)
+        rv, json = self.client.get(one_url, headers={
+            'If-Modified-Since': 'Thu, 10 Apr 2014 10:00:00 GMT'})
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['name'] == 'two')
+        rv, json = self.client.get('/api/v1.0/students/', headers={
+            'If-Modified-Since': 'Thu, 10 Apr 2014 11:00:00 GMT'})
+        self.assertTrue(rv.status_code == 200)
+
+        # resources modified in the current second are not dated, since
+        # another change in the same second would have the same date
+        db.session.execute(Student.__table__.update().values(
+            updated_at=datetime.utcnow() + timedelta(seconds=5)))
+        db.session.commit()
+        rv, json = self.client.get(one_url)
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue('Last-Modified' not in rv.headers)
+        rv, json = self.client.get(one_url, headers={
+            'If-Modified-Since': 'Thu, 10 Apr 2098 10:00:00 GMT'})
+        self.assertTrue(rv.status_code == 200)
+
+    def test_idempotency_keys(self):
+        # a retried post creates a single student
+        headers = {'Idempotency-Key': 'student-1'}
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'one'}, headers=headers)
+        self.assertTrue(rv.status_code == 201)
+        one_url = rv.headers['Location']
+        self.assertTrue('Idempotent-Replayed' not in rv.headers)
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'one'}, headers=headers)
+        self.assertTrue(rv.status_code == 201)
+        self.assertTrue(rv.headers['Location'] == one_url)
+        self.assertTrue(rv.headers['Idempotent-Replayed'] == 'true')
+        rv, json = self.client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['urls'] == [one_url])
+
+        # the key cannot be reused for a different request
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'two'}, headers=headers)
+        self.assertTrue(rv.status_code == 422)
+
+        # a retried registration is not a duplicate
+        rv, json = self.client.post('/api/v1.0/classes/',
+                                    data={'name': 'algebra'})
+        self.assertTrue(rv.status_code == 201)
+        algebra_url = rv.headers['Location']
+        headers = {'Idempotency-Key': 'registration-1'}
+        for i in range(2):
+            rv, json = self.client.post('/api/v1.0/registrations/',
+                                        data={'student': one_url,
+                                              'class': algebra_url},
+                                        headers=headers)
+            self.assertTrue(rv.status_code == 201)
+        rv, json = self.client.get(one_url + '/summary')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['registration_count'] == 1)
+
+        # requests that fail are not stored
+        headers = {'Idempotency-Key': 'student-2'}
+        with self.assertRaises(ValidationError):
+            self.client.post('/api/v1.0/students/', data={'nam': 'two'},
+                             headers=headers)
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'two'}, headers=headers)
+        self.assertTrue(rv.status_code == 201)
+
+        # a duplicate of a request in progress is rejected
+        headers = {'Idempotency-Key': 'student-3'}
+        with self.app.test_request_context():
+            g.user = User.query.first()
+            key = storage_key('student-3')
+        get_redis(self.app).set(key + '/lock', '1', nx=True)
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'three'}, headers=headers)
+        self.assertTrue(rv.status_code == 409)
+        self.assertTrue(rv.headers['Retry-After'] == '1')
+
+    def test_admission_control(self):
+        controller = AdmissionController(max_in_flight=1, queue_size=2,
+                                         queue_timeout=5)
+        self.assertTrue(controller.acquire(LOW))
+        admitted = []
+
+        def wait(name, priority):
+            admitted.append((name, controller.acquire(priority)))
+            if admitted[-1][1]:
+                controller.release()
+
+        # queue two low priority requests
+        threads = []
+        for name in ['low1', 'low2']:
+            threads.append(threading.Thread(target=wait, args=(name, LOW)))
+            threads[-1].start()
+            while controller.waiting() != len(threads):
+                time.sleep(0.01)
+
+        # a high priority request evicts the newest low priority one
+        threads.append(threading.Thread(target=wait, args=('high', HIGH)))
+        threads[-1].start()
+        while not admitted:
+            time.sleep(0.01)
+        self.assertTrue(admitted == [('low2', False)])
+
+        # the queue is full for low priority requests
+        self.assertFalse(controller.acquire(LOW))
+
+        # released slots go to high priority requests first
+        controller.release()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(admitted == [('low2', False), ('high', True),
+                                     ('low1', True)])
+        self.assertTrue(controller.in_flight == 0)
+
+        # requests that wait too long are rejected
+        controller.queue_timeout = 0.05
+        self.assertTrue(controller.acquire(HIGH))
+        self.assertFalse(controller.acquire(HIGH))
+        self.assertTrue(controller.waiting() == 0)
+        controller.release()
+
+        # overloaded processes reject requests with a 503 response
+        rv, json = self.client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+        controller = self.app.extensions['admission']
+        self.assertTrue(controller.in_flight == 0)
+        controller.in_flight = controller.max_in_flight
+        controller.queue_size = 0
+        rv, json = self.client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 503)
+        self.assertTrue(rv.headers['Retry-After'] == '1')
+        rv, json = self.client.get('/api/v1.0/changes/')
+        self.assertTrue(rv.status_code == 200)
+
+    def test_shared_cache(self):
+        cache = SharedCache(slots=8, slot_size=64)
+        self.assertTrue(cache.get(RESPONSES, b'a') is None)
+        self.assertTrue(cache.set(RESPONSES, b'a', b'one'))
+        self.assertTrue(cache.get(RESPONSES, b'a') == b'one')
+        self.assertTrue(cache.get(AUTH, b'a') is None)
+        self.assertTrue(cache.set(RESPONSES, b'a', b'two'))
+        self.assertTrue(cache.get(RESPONSES, b'a') == b'two')
+        self.assertFalse(cache.set(RESPONSES, b'b', b'x' * 64))
+
+        # entries expire
+        self.assertTrue(cache.set(AUTH, b'b', b'one', expires=100))
+        self.assertTrue(cache.get(AUTH, b'b', now=99) == b'one')
+        self.assertTrue(cache.get(AUTH, b'b', now=101) is None)
+
+        # invalidation discards the entries of a namespace, and values
+        # computed before the invalidation are not stored
+        version = cache.version(RESPONSES)
+        self.assertTrue(cache.set(AUTH, b'c', b'one'))
+        cache.invalidate(RESPONSES)
+        self.assertTrue(cache.get(RESPONSES, b'a') is None)
+        self.assertTrue(cache.get(AUTH, b'c') == b'one')
+        self.assertFalse(cache.set(RESPONSES, b'a', b'three', version))
+        self.assertTrue(cache.get(RESPONSES, b'a') is None)
+
+        # entries that were read recently are not evicted
+        cache = SharedCache(slots=8, slot_size=64)
+        for i in range(8):
+            self.assertTrue(cache.set(RESPONSES, str(i).encode(), b'v'))
+        for i in range(1, 8):
+            self.assertTrue(cache.get(RESPONSES, str(i).encode()) == b'v')
+        self.assertTrue(cache.set(RESPONSES, b'8', b'v'))
+        self.assertTrue(cache.get(RESPONSES, b'0') is None)
+        self.assertTrue(cache.get(RESPONSES, b'8') == b'v')
+
+        # the entries are shared with forked processes
+        pid = os.fork()
+        if pid == 0:
+            cache.set(RESPONSES, b'child', b'value')
+            os._exit(0 if cache.get(RESPONSES, b'1') == b'v' else 1)
+        self.assertTrue(os.waitpid(pid, 0)[1] == 0)
+        self.assertTrue(cache.get(RESPONSES, b'child') == b'value')
+
+        # a process killed while holding the lock does not block
+        # invalidations, but no more values are stored
+        pid = os.fork()
+        if pid == 0:
+            cache.lock.acquire()
+            os.kill(os.getpid(), signal.SIGKILL)
+        os.waitpid(pid, 0)
+        cache.invalidate(RESPONSES)
+        self.assertTrue(cache.get(RESPONSES, b'child') is None)
+        self.assertFalse(cache.set(RESPONSES, b'child', b'value'))
+
+        # verified tokens are cached, and the same type is returned for
+        # them
+        user = User.query.first()
+        token = user.generate_auth_token()
+        self.assertTrue(isinstance(User.verify_auth_token(token), UserRow))
+        self.assertTrue(self.app.extensions['shared_cache'].get(
+            AUTH, token.encode('utf-8')) is not None)
+        cached = User.verify_auth_token(token)
+        self.assertTrue(isinstance(cached, UserRow))
+        self.assertTrue(cached.id == user.id)
+        self.assertTrue(cached.username == user.username)
+        User.revoke_auth_token(token)
+        self.assertTrue(User.verify_auth_token(token) is None)
+
+        # cached tokens of deleted users are rejected
+        susan = User(username='susan', password='dog')
+        db.session.add(susan)
+        db.session.commit()
+        token = susan.generate_auth_token()
+        client = TestClient(self.app, token, '')
+        rv, json = client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(self.app.extensions['shared_cache'].get(
+            AUTH, token.encode('utf-8')) is not None)
+        db.session.delete(susan)
+        db.session.commit()
+        rv, json = client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 401)
+
+        # cached responses are replaced after a change
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'one'})
+        one_url = rv.headers['Location']
+        rv, json = self.client.get(one_url)
+        self.assertTrue(json['name'] == 'one')
+        etag = rv.headers['ETag']
+        rv, json = self.client.get(one_url)
+        self.assertTrue(json['name'] == 'one')
+        self.assertTrue(rv.headers['ETag'] == etag)
+        rv, json = self.client.put(one_url, data={'name': 'two'})
+        rv, json = self.client.get(one_url)
+        self.assertTrue(json['name'] == 'two')
+        self.assertTrue(rv.headers['ETag'] != etag)
+
+        # changes made outside of the API are seen when responses expire
+        with db.engine.begin() as connection:
+            connection.execute(Student.__table__.update().values(
+                name='three'))
+        rv, json = self.client.get(one_url)
+        self.assertTrue(json['name'] == 'two')
+        self.app.config['SHARED_CACHE_RESPONSE_TTL'] = 0
+        self.app.extensions['shared_cache'].invalidate(RESPONSES)
+        rv, json = self.client.get(one_url)
+        with db.engine.begin() as connection:
+            connection.execute(Student.__table__.update().values(
+                name='four'))
+        rv, json = self.client.get(one_url)
+        self.assertTrue(json['name'] == 'four')
+
+    def test_bulk_create(self):
+        self.app.config['BULK_CHUNK_SIZE'] = 2
+        ndjson = {'Content-Type': 'application/x-ndjson'}
+
+        # students and classes
+        rv, json = self.client.post(
+            '/api/v1.0/students/bulk',
+            '{"name": "susan"}\n{"name": "david"}\n\n{"name": "joe"}\n',
+            headers=ndjson)
+        self.assertTrue(rv.status_code == 201)
+        self.assertTrue(json['created'] == 3)
+        rv, json = self.client.post('/api/v1.0/classes/bulk',
+                                    '{"name": "algebra"}', headers=ndjson)
+        self.assertTrue(rv.status_code == 201)
+        self.assertTrue(json['created'] == 1)
+        rv, json = self.client.get('/api/v1.0/students/')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(len(json['urls']) == 3)
+        student_urls = json['urls']
+        rv, json = self.client.get('/api/v1.0/classes/')
+        algebra_url = json['urls'][0]
+        rv, json = self.client.get(algebra_url)
+        self.assertTrue(json['name'] == 'algebra')
+
+        # registrations
+        lines = ['{"student": "%s", "class": "%s"}' % (url, algebra_url)
+                 for url in student_urls]
+        rv, json = self.client.post('/api/v1.0/registrations/bulk',
+                                    '\n'.join(lines), headers=ndjson)
+        self.assertTrue(rv.status_code == 201)
+        self.assertTrue(json['created'] == 3)
+        rv, json = self.client.get(algebra_url + '/summary')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['registration_count'] == 3)
+        rv, json = self.client.get('/api/v1.0/changes/?since=0')
+        self.assertTrue(len(json['changes']) == 7)
+
+        # an invalid item anywhere rolls back the whole request
+        with self.assertRaises(ValidationError) as cm:
+            self.client.post(
+                '/api/v1.0/students/bulk',
+                '{"name": "a"}\n{"name": "b"}\n{"name": "c"}\n{"x": "d"}',
+                headers=ndjson)
+        self.assertTrue('Line 4' in cm.exception.args[0])
+        with self.assertRaises(ValidationError) as cm:
+            self.client.post('/api/v1.0/classes/bulk',
+                             '{"name": "x"}\n{"name":', headers=ndjson)
+        self.assertTrue('line 2' in cm.exception.args[0])
+        for line in ['[1]', '"x"', '3', 'null']:
+            with self.assertRaises(ValidationError) as cm:
+                self.client.post('/api/v1.0/students/bulk',
+                                 '{"name": "x"}\n' + line, headers=ndjson)
+            self.assertTrue('Line 2' in cm.exception.args[0])
+        rv, json = self.client.get('/api/v1.0/students/')
+        self.assertTrue(len(json['urls']) == 3)
+
+        # duplicate registrations, in the database or in the request
+        line = '{"student": "%s", "class": "%s"}' % (student_urls[0],
+                                                    algebra_url)
+        with self.assertRaises(ValidationError) as cm:
+            self.client.post('/api/v1.0/registrations/bulk',
+                             line, headers=ndjson)
+        self.assertTrue('Line 1' in cm.exception.args[0])
+        rv, json = self.client.post('/api/v1.0/classes/',
+                                    data={'name': 'geometry'})
+        line = line.replace(algebra_url, rv.headers['Location'])
+        with self.assertRaises(ValidationError) as cm:
+            self.client.post('/api/v1.0/registrations/bulk',
+                             '\n'.join([line, line]), headers=ndjson)
+        self.assertTrue('Line 2' in cm.exception.args[0])
+        rv, json = self.client.get('/api/v1.0/registrations/')
+        self.assertTrue(len(json['urls']) == 3)
+
+    def test_metrics(self):
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'susan'})
+        self.assertTrue(rv.status_code == 201)
+        url = rv.headers['Location']
+        self.app.config['USE_RATE_LIMITS'] = True
+        self.app.config['RATE_LIMITS'] = [(1, 20)]
+        rv, json = self.client.get(url)
+        self.assertTrue(rv.status_code == 200)
+        etag = rv.headers['ETag']
+        rv, json = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertTrue(rv.status_code == 429)
+        self.app.config['USE_RATE_LIMITS'] = False
+        rv, json = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertTrue(rv.status_code == 304)
+        bad_client = TestClient(self.app, 'bad', 'token')
+        rv, json = bad_client.get(url)
+        self.assertTrue(rv.status_code == 401)
+
+        # metrics from another worker process are added
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.app.config['METRICS_DIR'] = tmpdir
+            self.app.extensions['metrics'].directory = tmpdir
+            other = Metrics(self.app.config['METRICS_BUCKETS'], tmpdir)
+            other.inc('auth_failures_total', amount=2)
+            other.observe('http_request_duration_seconds',
+                          (('endpoint', 'api.get_student'),), 100)
+            other.flush()
+            os.rename(other.snapshot_path(os.getpid()),
+                      other.snapshot_path(1))
+
+            # only the counters of processes that exited are added
+            pid = os.fork()
+            if pid == 0:
+                os._exit(0)
+            os.waitpid(pid, 0)
+            other = Metrics(self.app.config['METRICS_BUCKETS'], tmpdir)
+            other.inc('auth_failures_total')
+            snapshot = other.snapshot()
+            snapshot['counters'].append(['db_pool_checked_out', [], 100])
+            other.write(other.snapshot_path(pid), snapshot)
+            rv = self.app.test_client().get('/metrics')
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(rv.headers['Content-Type'].startswith('text/plain'))
+        lines = rv.data.decode('utf-8').splitlines()
+        self.assertTrue('# TYPE http_request_duration_seconds histogram' in
+                        lines)
+        self.assertTrue('http_requests_total{endpoint="api.get_student",'
+                        'method="GET",status="304"} 1' in lines)
+        self.assertTrue('rate_limit_rejections_total{'
+                        'endpoint="api.get_student"} 1' in lines)
+        self.assertTrue('etag_not_modified_total{'
+                        'endpoint="api.get_student"} 1' in lines)
+        self.assertTrue('auth_failures_total 4' in lines)
+        checked_out = [line for line in lines
+                       if line.startswith('db_pool_checked_out ')]
+        self.assertTrue(int(checked_out[0].split()[1]) < 100)
+        self.assertTrue('http_request_duration_seconds_bucket{'
+                        'endpoint="api.get_student",le="10.0"} 4' in lines)
+        self.assertTrue('http_request_duration_seconds_count{'
+                        'endpoint="api.get_student"} 5' in lines)
+        self.assertTrue(len([line for line in lines
+                             if line.startswith('db_pool_checkouts_total ')])
+                        == 1)
+
+    def test_registration_insert(self):
+        rv, json = self.client.post('/api/v1.0/students/',
+                                    data={'name': 'susan'})
+        susan_url = rv.headers['Location']
+        rv, json = self.client.post('/api/v1.0/classes/',
+                                    data={'name': 'algebra'})
+        algebra_url = rv.headers['Location']
+
+        # the student and the class are not looked up before the insert
+        statements = []
+
+        def before_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_execute)
+        try:
+            rv, json = self.client.post('/api/v1.0/registrations/', data={
+                'student': susan_url, 'class': algebra_url})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_execute)
+        self.assertTrue(rv.status_code == 201)
+        self.assertTrue(len([s for s in statements
+                             if s.startswith('INSERT INTO registrations')])
+                        == 1)
+        self.assertFalse([s for s in statements if s.startswith('SELECT') and
+                          ('FROM students' in s or 'FROM classes' in s)])
+
+        # constraint violations are validation errors
+        with self.assertRaises(ValidationError) as cm:
+            self.client.post('/api/v1.0/registrations/', data={
+                'student': susan_url, 'class': algebra_url})
+        self.assertTrue('already registered' in cm.exception.args[0])
+        with self.assertRaises(ValidationError) as cm:
+            self.client.post('/api/v1.0/registrations/', data={
+                'student': susan_url + '1', 'class': algebra_url})
+        self.assertTrue(cm.exception.args[0] == 'Invalid student URL')
+        with self.assertRaises(ValidationError) as cm:
+            self.client.post('/api/v1.0/registrations/', data={
+                'student': susan_url, 'class': algebra_url + '1'})
+        self.assertTrue(cm.exception.args[0] == 'Invalid class URL')
+        db.session.remove()
+        self.assertTrue(Registration.query.count() == 1)
+        rv, json = self.client.get(susan_url + '/summary')
+        self.assertTrue(json['registration_count'] == 1)
+
+    def test_cascade_delete(self):
+        rv, json = self.client.post('/api/v1.0/classes/',
+                                    data={'name': 'algebra'})
+        algebra_url = rv.headers['Location']
+        student_urls = []
+        for name in ['susan', 'david', 'joe']:
+            rv, json = self.client.post('/api/v1.0/students/',
+                                        data={'name': name})
+            student_urls.append(rv.headers['Location'])
+            rv, json = self.client.post('/api/v1.0/registrations/', data={
+                'student': student_urls[-1], 'class': algebra_url})
+            self.assertTrue(rv.status_code == 201)
+
+        # the registrations of a class are deleted with one statement
+        statements = []
+
+        def before_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_execute)
+        try:
+            rv, json = self.client.delete(algebra_url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_execute)
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(len([s for s in statements
+                             if s.startswith('DELETE FROM registrations')])
+                        == 1)
+        self.assertTrue(Registration.query.count() == 0)
+        rv, json = self.client.get(student_urls[0] + '/summary')
+        self.assertTrue(json['registration_count'] == 0)
+
+        # the database deletes the registrations of a deleted student
+        rv, json = self.client.post('/api/v1.0/classes/',
+                                    data={'name': 'lit'})
+        rv, json = self.client.post('/api/v1.0/registrations/', data={
+            'student': student_urls[0], 'class': rv.headers['Location']})
+        self.assertTrue(Registration.query.count() == 1)
+        db.session.execute(Student.__table__.delete())
+        self.assertTrue(Registration.query.count() == 0)
+
+    def test_request_coalescing(self):
+        calls = []
+
+        @etag
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return '{"calls": %d}' % len(calls)
+
+        self.app.add_url_rule('/slow', 'slow', slow)
+        responses = []
+
+        def get():
+            rv = self.app.test_client().get('/slow')
+            responses.append((rv.status_code, rv.headers['ETag'], rv.data))
+
+        threads = [threading.Thread(target=get) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(len(calls) == 1)
+        self.assertTrue(len(responses) == 8)
+        self.assertTrue(len(set(responses)) == 1)
+        self.assertTrue(responses[0][0] == 200)
+
+        # requests that are not concurrent are not coalesced
+        self.app.extensions['shared_cache'].invalidate(RESPONSES)
+        self.app.test_client().get('/slow')
+        self.assertTrue(len(calls) == 2)
+
+        rv = self.app.test_client().get('/metrics')
+        lines = rv.data.decode('utf-8').splitlines()
+        self.assertTrue('coalescing_leaders_total{endpoint="slow"} 2' in lines)
+        self.assertTrue('coalesced_requests_total{endpoint="slow"} 7' in lines)
+
+    def test_sharding(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.app.config['SQLALCHEMY_BINDS'] = dict(
+            (name, 'sqlite:///' + os.path.join(tmpdir, name + '.sqlite'))
+            for name in ['shard0', 'shard1'])
+        self.app.config['REGISTRATION_SHARDS'] = ['shard0', 'shard1']
+        db.create_all()
+
+        students = []
+        for name in ['one', 'two', 'three', 'four']:
+            rv, json = self.client.post('/api/v1.0/students/',
+                                        data={'name': name})
+            students.append(rv.headers['Location'])
+        classes = []
+        for name in ['algebra', 'lit']:
+            rv, json = self.client.post('/api/v1.0/classes/',
+                                        data={'name': name})
+            classes.append(rv.headers['Location'])
+        for student in students:
+            rv, json = self.client.post('/api/v1.0/registrations/', data={
+                'student': student, 'class': classes[0]})
+            self.assertTrue(rv.status_code == 201)
+        rv, json = self.client.post(
+            '/api/v1.0/registrations/bulk',
+            '\n'.join('{"student": "%s", "class": "%s"}' % (student,
+                                                            classes[1])
+                      for student in students[2::-2]),
+            headers={'Content-Type': 'application/x-ndjson'})
+        self.assertTrue(rv.status_code == 201)
+
+        # registrations are stored in the shard of their student
+        def shard_rows(bind):
+            return sorted(tuple(row) for row in db.get_engine(
+                self.app, bind).execute(
+                    'SELECT student_id, class_id FROM registrations'))
+
+        self.assertTrue(shard_rows('shard0') == [(2, 1), (4, 1)])
+        self.assertTrue(shard_rows('shard1') == [(1, 1), (1, 2), (3, 1),
+                                                 (3, 2)])
+        self.assertTrue(Registration.query.count() == 0)
+
+        # single registrations
+        rv, json = self.client.get('/api/v1.0/registrations/3/2')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['student'] == students[2])
+        self.assertTrue(json['class'] == classes[1])
+        rv, json = self.client.get('/api/v1.0/registrations/2/2')
+        self.assertTrue(rv.status_code == 404)
+
+        # pages are merged from all the shards
+        rv, json = self.client.get('/api/v1.0/registrations/?per_page=4')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(json['meta']['total'] == 6)
+        self.assertTrue(json['urls'] == [
+            'http://localhost/api/v1.0/registrations/%d/%d' % key
+            for key in [(1, 1), (1, 2), (2, 1), (3, 1)]])
+        rv, json = self.client.get(
+            json['meta']['next'].replace('http://localhost', ''))
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(len(json['urls']) == 2)
+        self.assertTrue(json['meta']['next'] is None)
+        # pages past the end are rejected without reading any rows
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engines = [db.get_engine(self.app, bind)
+                   for bind in ['shard0', 'shard1']]
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', record)
+        try:
+            rv, json = self.client.get(
+                '/api/v1.0/registrations/?per_page=4&page=1000000')
+        finally:
+            for engine in engines:
+                event.remove(engine, 'before_cursor_execute', record)
+        self.assertTrue(rv.status_code == 404)
+        self.assertTrue(len(statements) == 2)
+        self.assertTrue(all('count' in statement.lower()
+                            for statement in statements))
+        rv, json = self.client.get(classes[0] + '/registrations/')
+        self.assertTrue(json['meta']['total'] == 4)
+        rv, json = self.client.get(students[2] + '/registrations/')
+        self.assertTrue(json['meta']['total'] == 2)
+        rv, json = self.client.get(classes[0] + '/summary')
+        self.assertTrue(json['student_ids'] == [1, 2, 3, 4])
+        self.assertTrue(json['registration_count'] == 4)
+
+        # deletions
+        rv, json = self.client.delete('/api/v1.0/registrations/3/1')
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(shard_rows('shard1') == [(1, 1), (1, 2), (3, 2)])
+        rv, json = self.client.delete(classes[0])
+        self.assertTrue(rv.status_code == 200)
+        self.assertTrue(shard_rows('shard0') == [])
+        self.assertTrue(shard_rows('shard1') == [(1, 2), (3, 2)])
+        rv, json = self.client.get(students[0] + '/summary')
+        self.assertTrue(json['registration_count'] == 1)
+        self.assertTrue(json['class_ids'] == [2])
+        rv, json = self.client.get(students[1] + '/summary')
+        self.assertTrue(json['registration_count'] == 0)
+
+        # imported registrations must reference existing students and classes
+        path = os.path.join(tmpdir, 'registrations.csv')
+        with open(path, 'w') as f:
+            f.write('student_id,class_id\n2,2\n99,2\n')
+        with self.assertRaises(ValueError):
+            bulk_import({'registrations': path})
+        with open(path, 'w') as f:
+            f.write('student_id,class_id\n2,2\n4,99\n')
+        with self.assertRaises(ValueError):
+            bulk_import({'registrations': path})
+        self.assertTrue(shard_rows('shard0') == [])
+        self.assertTrue(shard_rows('shard1') == [(1, 2), (3, 2)])
@@ -1,5 +1,7 @@
 from base64 import b64encode
 from werkzeug.exceptions import HTTPException
+import gzip
+import io
 import json
 
 
@@ -12,9 +14,9 @@ class TestClient():
     def send(self, url, method='GET', data=None, headers={}):
         headers = headers.copy()
         headers['Authorization'] = self.auth
-        headers['Content-Type'] = 'application/json'
+        headers.setdefault('Content-Type', 'application/json')
         headers['Accept'] = 'application/json'
-        if data:
+        if data and not isinstance(data, str):
             data = json.dumps(data)
 
         with self.app.test_request_context(url, method=method, data=data,
@@ -28,7 +30,10 @@ class TestClient():
             except HTTPException as e:
                 rv = self.app.handle_user_exception(e)
 
-        return rv, json.loads(rv.data.decode('utf-8'))
+        data = rv.data
+        if rv.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+        return rv, json.loads(data.decode('utf-8'))
 
     def get(self, url, headers={}):
         return self.send(url, 'GET', headers=headers)
@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from base64 import b64encode
+try:
+    from urllib.request import Request, urlopen
+except ImportError:  # pragma: no cover
+    from urllib2 import Request, urlopen
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+server_script = '''
+import os
+import sys
+from flask import jsonify
+from api.app import create_app
+from api.models import db, User
+from api.prefork import PreforkServer
+
+def factory():
+    app = create_app('test_config')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + sys.argv[1]
+    app.config['METRICS_DIR'] = os.path.dirname(sys.argv[1])
+    app.extensions['metrics'].directory = app.config['METRICS_DIR']
+    # only the workers warm up, as the database is created afterwards
+    app.config['WARMUP_ON_STARTUP'] = True
+    app.add_url_rule('/pid', 'pid', lambda: jsonify({'pid': os.getpid()}))
+    return app
+
+app = factory()
+with app.app_context():
+    db.create_all()
+    user = User(username='dave', password='cat')
+    db.session.add(user)
+    db.session.commit()
+    token = user.generate_auth_token()
+    db.session.remove()
+server = PreforkServer(factory, port=0, workers=1, max_requests=5,
+                       access_log=False)
+print(server.address[1])
+print(token)
+sys.stdout.flush()
+server.run()
+'''
+
+
+class TestPrefork(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = subprocess.Popen(
+            [sys.executable, '-W', 'ignore', '-c', server_script,
+             os.path.join(self.tmpdir, 'api.sqlite')],
+            cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.port = int(self.server.stdout.readline())
+        self.token = self.server.stdout.readline().decode('utf-8').strip()
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.server.kill()
+            self.server.wait()
+        self.server.stdout.close()
+        self.server.stderr.close()
+        shutil.rmtree(self.tmpdir)
+
+    def get(self, url, raw=False):
+        request = Request('http://127.0.0.1:%d%s' % (self.port, url))
+        request.add_header('Authorization', 'Basic ' + b64encode(
+            (self.token + ':').encode('utf-8')).decode('utf-8'))
+        response = urlopen(request, timeout=10)
+        data = response.read().decode('utf-8')
+        return response.getcode(), data if raw else json.loads(data)
+
+    def test_workers(self):
+        # the database is shared with the workers
+        status, data = self.get('/api/v1.0/students/')
+        self.assertTrue(status == 200)
+        self.assertTrue(data['urls'] == [])
+
+        # the worker is recycled after five requests
+        pids = [self.get('/pid')[1]['pid'] for i in range(5)]
+        self.assertTrue(len(set(pids[:4])) == 1)
+        self.assertTrue(pids[4] != pids[3])
+
+        # the metrics of the recycled worker are kept, including those of
+        # the requests it handled after its last flush
+        time.sleep(0.5)
+        self.assertFalse(os.path.exists(os.path.join(
+            self.tmpdir, 'metrics-%d.json' % pids[3])))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmpdir, 'metrics-retired.json')))
+        status, data = self.get('/metrics', raw=True)
+        lines = data.splitlines()
+        self.assertTrue('http_requests_total{endpoint="pid",method="GET",'
+                        'status="200"} 5' in lines)
+        self.assertTrue('db_pool_checked_out 0' in lines)
+
+        # reload replaces the worker
+        self.server.send_signal(signal.SIGHUP)
+        time.sleep(1.5)
+        self.assertTrue(self.get('/pid')[1]['pid'] != pids[4])
+
+        # graceful stop
+        self.server.send_signal(signal.SIGTERM)
+        self.assertTrue(self.server.wait() == 0)
@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+from api.app import create_app
+from api.rate_limit import RateLimit
+
+
+class TestRateLimit(unittest.TestCase):
+    threads = 8
+    hits = 250
+    limits = [(10 ** 6, 3600), (10 ** 6, 60)]
+
+    def hit_concurrently(self, hit):
+        # all the hits use the same time, so they are counted in the same
+        # period even if the test runs across the end of a period
+        now = time.time()
+        start = threading.Event()
+
+        def run():
+            start.wait()
+            for i in range(self.hits):
+                hit(now)
+
+        threads = [threading.Thread(target=run) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return now
+
+    def test_concurrent_hits(self):
+        apps = [create_app('test_config') for i in range(2)]
+        limiters = [app.extensions['rate_limit'] for app in apps]
+
+        # the Redis clients are created lazily by the racing threads
+        for limiter in limiters:
+            self.assertTrue(limiter.redis is None)
+        results = {}
+
+        def worker(limiter):
+            results[limiter] = self.hit_concurrently(
+                lambda now: limiter.hit('stress/', self.limits, now=now))
+
+        workers = [threading.Thread(target=worker, args=(limiter,))
+                   for limiter in limiters]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+
+        # counts are exact in every tier and not shared between apps
+        self.assertTrue(limiters[0].redis is not limiters[1].redis)
+        for limiter in limiters:
+            rv = limiter.hit('stress/', self.limits, now=results[limiter])
+            self.assertTrue([tier[3] for tier in rv.tiers] ==
+                            [self.threads * self.hits + 1] * 2)
+
+    def test_concurrent_hits_redis(self):
+        # the atomicity of the pipeline can only be tested with a real
+        # Redis server
+        from redis import Redis
+        from redis.exceptions import ConnectionError
+        redis = Redis()
+        try:
+            redis.ping()
+        except ConnectionError:
+            self.skipTest('no Redis server on localhost')
+        prefix = 'test-rate-limit/%f/' % time.time()
+        try:
+            now = self.hit_concurrently(
+                lambda now: RateLimit(redis, prefix, self.limits, now=now))
+            rv = RateLimit(redis, prefix, self.limits, now=now)
+            self.assertTrue([tier[3] for tier in rv.tiers] ==
+                            [self.threads * self.hits + 1] * 2)
+        finally:
+            keys = redis.keys(prefix + '*')
+            if keys:
+                redis.delete(*keys)
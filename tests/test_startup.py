@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+startup_script = '''
+import sys
+import time
+import test_config
+# the dependencies are imported before the measurement starts, since the
+# modules they load and the time they take depend on their versions
+import flask
+import flask_httpauth
+import flask_sqlalchemy
+for arg in sys.argv[1:]:
+    name, value = arg.split('=')
+    setattr(test_config, name, value == 'on')
+preloaded = set(sys.modules)
+start = time.time()
+from api.app import create_app
+create_app(test_config)
+print(time.time() - start)
+print(' '.join(sorted(set(sys.modules) - preloaded)))
+'''
+
+# configuration variables of the optional features, and the modules that
+# are only needed when they are enabled
+optional_features = ['USE_TOKEN_AUTH', 'USE_TOKEN_REVOCATION',
+                     'USE_COMPRESSION', 'USE_METRICS',
+                     'USE_REQUEST_COALESCING', 'USE_IDEMPOTENCY_KEYS',
+                     'USE_ADMISSION_CONTROL', 'USE_SHARED_CACHE']
+optional_modules = ['api.token', 'api.revocation', 'api.compress',
+                    'api.metrics', 'api.coalesce', 'api.idempotency',
+                    'api.admission', 'api.shared_cache']
+
+pool_listeners_script = '''
+import sys
+import test_config
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+from api.app import create_app
+from api import metrics
+test_config.USE_METRICS = sys.argv[1] == 'on'
+create_app(test_config)
+print(all(event.contains(Pool, name, listener)
+          for name, listener in metrics.pool_listeners))
+'''
+
+
+class TestStartup(unittest.TestCase):
+    def start_app(self, setting, options=()):
+        args = [name + '=' + setting for name in optional_features]
+        output = subprocess.check_output(
+            [sys.executable] + list(options) +
+            ['-W', 'ignore', '-c', startup_script] + args,
+            cwd=root, stderr=subprocess.STDOUT).decode('utf-8').splitlines()
+        return float(output[-2]), output[-1].split(), output[:-2]
+
+    def test_lazy_imports(self):
+        # modules that the application loads on startup, with the optional
+        # features disabled and enabled
+        elapsed, modules, log = self.start_app('off')
+        self.assertTrue('api.models' in modules)
+        for module in optional_modules + ['gzip', 'mmap', 'multiprocessing',
+                                          'sqlite3', 'redis',
+                                          'werkzeug.security']:
+            self.assertFalse(module in modules)
+        elapsed, modules, log = self.start_app('on')
+        for module in optional_modules:
+            self.assertTrue(module in modules)
+        self.assertFalse('redis' in modules)
+        self.assertFalse('werkzeug.security' in modules)
+
+    def test_startup_time(self):
+        # best of several cold starts, to reduce noise from the system; the
+        # time is reported, as the loaded modules are what the tests check
+        elapsed = min(self.start_app('off')[0] for i in range(3))
+        sys.stderr.write('startup time: %.1fms\n' % (elapsed * 1000))
+        if sys.version_info < (3, 7):
+            return
+
+        # self import time of the application modules
+        log = self.start_app('off', ['-X', 'importtime'])[2]
+        times = {}
+        for line in log:
+            fields = line.split('|')
+            if line.startswith('import time:') and \
+                    fields[0].split(':')[1].strip().isdigit():
+                times[fields[2].strip()] = int(fields[0].split(':')[1])
+        modules = [name for name in times
+                   if name == 'api' or name.startswith('api.')]
+        self.assertTrue('api.app' in modules)
+        for name in sorted(modules, key=lambda name: -times[name])[:5]:
+            sys.stderr.write('  %-24s %6.1fms\n' % (name,
+                                                     times[name] / 1000.0))
+
+    def test_pool_listeners(self):
+        # the connection pools are only instrumented when metrics are on
+        for setting, expected in [('off', 'False'), ('on', 'True')]:
+            output = subprocess.check_output(
+                [sys.executable, '-W', 'ignore', '-c', pool_listeners_script,
+                 setting], cwd=root).decode('utf-8').strip()
+            self.assertTrue(output == expected)